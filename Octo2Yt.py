@@ -113,12 +113,11 @@ def deco1(f):
     import yt
     yt.add_field(('gas','velocity_x'), function=_velocity_x, units="cm/s", take_log=False,
                      display_name='x velocity', sampling_type="cell", force_override=True)
-def octo2yt_amr(filename, nspecies=1, epsilon_2=0.001, gather_outflows=True, copy_path='', savefile=True):
+def octo2yt_amr(filename, nspecies=1, epsilon_2=0.001, gather_outflows=True, copy_path='', savefile=True, nprocs=1, cache_format='npz', fields=None, region=None, max_level=None):
     import numpy as np
     import h5py
-    import sys
     import yt
-    import os
+    from functools import partial
     from tqdm import tqdm
 
     #filename = '/home/shiber/simulations/sphere_ref5_1grid/final.silo'
@@ -149,18 +148,6 @@ def octo2yt_amr(filename, nspecies=1, epsilon_2=0.001, gather_outflows=True, cop
        # omega = f['omega'][0]
 
         
-    octo_fields = ['egas', 'sx', 'sy', 'sz', 'tau', 'lz', 'pot', 'gx', 'gy', 'gz']
-#    octo_fields = ['egas', 'sx', 'sy', 'sz', 'tau', 'lz', 'phi', 'gx', 'gy', 'gz']
-    outflow_fields = ['egas', 'sx', 'sy', 'sz', 'tau', 'lz', 'pot']
-#    outflow_conversions = [mass_to_g * length_to_cm**2 / time_to_s**2, mass_to_g * length_to_cm / time_to_s, mass_to_g * length_to_cm / time_to_s, mass_to_g * length_to_cm / time_to_s, 
-#                (mass_to_g * length_to_cm**2 / time_to_s**2)**(1 / adiabatic_index), mass_to_g * length_to_cm**2 / time_to_s, 
-#                mass_to_g * length_to_cm**2 / time_to_s**2 ]
-# tau is the entropy tracer defined by the internal energy density in power of the inverse of the adiabtic index (e^(1/gamma))
-
-    units = ['erg/cm**3', 'g/(s*cm**2)', 'g/(s*cm**2)', 'g/(s*cm**2)', '(erg/cm**3)**('+str(adiabatic_index)+')', 'g/(cm*s)', 'erg/cm**3', 'erg/(g*cm)', 'erg/(g*cm)', 'erg/(g*cm)']
-
-    yt_fields = ['egas', 'sx', 'sy', 'sz', 'tau', 'lz', 'pot', 'gx', 'gy', 'gz']
-
         #print 'reading headers...'
 
 
@@ -200,13 +187,20 @@ def octo2yt_amr(filename, nspecies=1, epsilon_2=0.001, gather_outflows=True, cop
        #                         print i, hdf5_fields, pos
         #                        fields_order.append(int(pos))
 
-    f2, hdf5_fields, fields_order, leaf_count, total_nodes, xscale, length_to_cm, time_to_s, mass_to_g, sim_time, omega, \
-        atomic_numbers, atmoic_masses, Xs, Zs, \
-        spec_octo_fields, spec_units, spec_yt_fields, spec_outflow_fields, spec_outflow_conversions = read_headers(filename, nspecies)
-
-    outflow_conversions = [mass_to_g * length_to_cm**2 / time_to_s**2, mass_to_g * length_to_cm / time_to_s, mass_to_g * length_to_cm / time_to_s, mass_to_g * length_to_cm / time_to_s,
-                                (mass_to_g * length_to_cm**2 / time_to_s**2)**(1 / adiabatic_index), mass_to_g * length_to_cm**2 / time_to_s,
-                                mass_to_g * length_to_cm**2 / time_to_s**2 ]
+    layout = read_layout(filename, nspecies)
+    hdf5_fields = layout['hdf5_fields']
+    leaf_count = layout['leaf_count']
+    xscale = layout['xscale']
+    length_to_cm = layout['length_to_cm']
+    time_to_s = layout['time_to_s']
+    mass_to_g = layout['mass_to_g']
+    sim_time = layout['sim_time']
+    omega = layout['omega']
+    octo_fields = layout['octo_fields']
+    units = layout['units']
+    yt_fields = layout['yt_fields']
+    outflow_fields = layout['outflow_fields']
+    outflow_conversions = layout['outflow_conversions']
 
     
 #        total_nodes = f['node_count'][0]
@@ -220,18 +214,6 @@ def octo2yt_amr(filename, nspecies=1, epsilon_2=0.001, gather_outflows=True, cop
 
         #print 'headers have been read successfully!'
 
-    field_round = len(hdf5_fields) + 3
-    number_of_fields = len(hdf5_fields)
-
-    hdf5_fields = np.array(hdf5_fields)[np.argsort(np.array(fields_order))]
-
-    octo_fields = octo_fields + spec_octo_fields
-    units = units + spec_units
-    yt_fields = yt_fields + spec_yt_fields
-    outflow_fields = outflow_fields + spec_outflow_fields
-    outflow_conversions = outflow_conversions + spec_outflow_conversions
-
-    hdf5_data = f['.silo']
     grid_data = []
 
     print('\nbox size: ', xscale)#, ' base resolution: ', grid_size
@@ -239,93 +221,78 @@ def octo2yt_amr(filename, nspecies=1, epsilon_2=0.001, gather_outflows=True, cop
     print(octo_fields, '\nas:\n', yt_fields[:len(octo_fields)], '\nwith physical units:\n', units[:len(octo_fields)], '\n')
 
     print('reading... (from overall', leaf_count, 'leaves)')
-    total_leaves = 0
-    cur_leaf_count = 0
-    io_file = 0
-    data_file = filename
+    data_files = layout['data_files']
+    if data_files[0][0] != filename:
+        print('\n\nnew scheme of data detected. Reading using the new scheme...\n')
     outflows = []
-    min_level = 100
-    pbar = tqdm(total=leaf_count, ncols=80)
-    while os.path.exists(data_file):    
-        if io_file > 0:
-            print('\n\nreading file', str(io_file), '...')
-            f_data = h5py.File(data_file, "r")
-            if gather_outflows:
-                outflows_temp = get_outflows_f(f_data, outflow_fields)
-                print('\ncontinuing reading fields...')
-                outflows = outflows + outflows_temp
-            hdf5_data = f_data['.silo']
-            cur_leaf_count = len(list(hdf5_data.keys())) / field_round
-        else:
-            if (len(list(hdf5_data.items())) < 100):
-                f_data = h5py.File(filename + '.data/0.silo', "r")
-                hdf5_data = f_data['.silo']
-                cur_leaf_count = len(list(hdf5_data.keys())) / field_round
-                print('\n\nnew scheme of data detected. Reading using the new scheme...\n')
-                if gather_outflows:
-                    outflows = get_outflows_f(f_data, outflow_fields)
-                    print('\ncontinuing reading fields...')
-            else:
-                if gather_outflows:
-                    outflows = get_outflows_f(f, outflow_fields)
-                    print('\ncontinuing reading fields...')
-                cur_leaf_count = leaf_count
-        io_file = io_file + 1
-        data_file = filename + '.data/'+str(io_file)+'.silo'
-#            for leaf in tqdm(range (0, cur_leaf_count), ncols=80):
-        for leaf in range (0, int(cur_leaf_count)):
-#    print leaf, cur_leaf_countutotal_leaves = total_leaves + 1
-            total_leaves = total_leaves + 1
-            cur_field = leaf * field_round + 1
-           # print "\033[K", float("{0:.1f}".format(total_leaves * 100.0 / leaf_count)), "%\r",
-            sys.stdout.flush()
-            x_vec, x_length = get_coord(hdf5_data, cur_field)
-            x_vec = make_fraction(x_vec, xscale * length_to_cm) 
-            cur_field += 1
-            y_vec, y_length = get_coord(hdf5_data, cur_field)
-            y_vec = make_fraction(y_vec, xscale * length_to_cm)
-            cur_field += 1
-            z_vec, z_length = get_coord(hdf5_data, cur_field)               
-            z_vec = make_fraction(z_vec, xscale * length_to_cm)
-            #print 'level', -np.log2((x_vec[1]-x_vec[0]))
-            cur_level = int(round(-np.log2((x_vec[1]-x_vec[0])))) - 2
-            min_level = min(cur_level, min_level)
-            cur_grid = dict(left_edge=[x_vec[0], y_vec[0], z_vec[0]],
-            right_edge=[x_vec[-1], y_vec[-1], z_vec[-1]],
-            level = cur_level,
-            dimensions=[x_length-1, y_length - 1, z_length - 1])
-            for field in range (0, number_of_fields):
-                cur_field += 1
-                cur_field_name = hdf5_fields[field]
-                if octo_fields.count(cur_field_name) > 0:
-                    ind = octo_fields.index(cur_field_name)
-                    dens = hdf5_data['#'+str(cur_field).zfill(6)]
-                    cur_grid[yt_fields[ind]] = (np.transpose(np.array(dens), (2,1,0)), units[ind])
-            tmpDens = np.zeros(np.shape(cur_grid['rho_1'][0]))
-            tmpn = np.zeros(np.shape(cur_grid['rho_1'][0]))
-            for i in range(0, nspecies):
-                atomic_numbers[i] = 1.008
-                mu = atomic_numbers[i]
-                tmpDens = tmpDens + cur_grid['rho_'+str(i+1)][0]
-                tmpn = tmpn + cur_grid['rho_'+str(i+1)][0] / mu / yt.physical_constants.mass_hydrogen
-    
-            cur_grid['density'] = (tmpDens, cur_grid['rho_1'][1])
-            cur_grid['n'] = (tmpn, cur_grid['rho_1'][1]+'/g')
-            pbar.update(1)
-            grid_data.append(cur_grid)
-        
+    build_index = region is None and load_leaf_index(filename, layout) is None
+    if build_index:
+        # no leaf index yet: every worker reads the coordinates of its file anyway, the index is built from those
+        files = [(data_file, cur_leaf_count, None, None) for data_file, cur_leaf_count in data_files]
+        pbar = tqdm(total=leaf_count, ncols=80)
+    else:
+        files = index_by_file(filename, layout, region)
+        pbar = tqdm(total=sum([len(d[3]) for d in files]), ncols=80)
+    read_file = partial(read_silo_leaves, hdf5_fields=hdf5_fields, octo_fields=octo_fields, yt_fields=yt_fields,
+                        units=units, nspecies=nspecies, xscale=xscale, length_to_cm=length_to_cm, fields=fields,
+                        outflow_fields=outflow_fields if gather_outflows else None)
+    # every file is opened once: its outflow totals (and geometry) are read in the same pass as its leaves
+    file_infos = []
+    if nprocs > 1:
+        # every sub-file is converted independently and collected back in leaf order
+        print('reading', len(data_files), 'files with', nprocs, 'processes...')
+        with process_pool(nprocs) as pool:
+            leaf_jobs = [pool.submit(read_file, d[0], d[1], geometry=d[2], select=d[3]) for d in files]
+            for job in leaf_jobs:
+                grids, info = job.result()
+                pbar.update(len(grids))
+                grid_data.extend(grids)
+                file_infos.append(info)
+    else:
+        for io_file, (data_file, cur_leaf_count, geometry, select) in enumerate(files):
+            if io_file > 0:
+                print('\n\nreading file', str(io_file), '...')
+            grids, info = read_file(data_file, cur_leaf_count, geometry=geometry, select=select, pbar=pbar)
+            grid_data.extend(grids)
+            file_infos.append(info)
+    if build_index:
+        index = save_leaf_index(filename, layout, [info['geometry'] for info in file_infos])
+    else:
+        index = read_leaf_index(filename, layout)
+    if gather_outflows:
+        outflows = np.array([sum(info['outflows'][name] for info in file_infos) for name in outflow_fields])
+        print('\noutflows values:')
+        for i in range(0, len(outflow_fields)):
+            print(' -', outflow_fields[i], outflows[i])
+    # root grid of the whole snapshot, also when only the leaves of a region were read
+    min_level = min([int(level) for level in index['level']] + [100])
+
     print('\nfields have been read successfully!\n')
     pbar.close()
 
     grid_size = 8*2**min_level
 
+    if savefile and (fields is not None or region is not None):
+        # under the copy's name a field subset or region would later be loaded as the complete snapshot
+        print('\nonly part of the snapshot was read, not saving a copy')
+        savefile = False
     if copy_path == '':
             copy_filename = filename + '.yt'
     else:
             copy_filename = copy_path + '/' + f.filename[f.filename.rfind('/')+1:] + '.yt'
+    # 'columns' writes the memory-mappable cache directory (filename.ytc) instead of the pickled .yt.npz
+    save_grid = saveGridToNPZ
+    if cache_format == 'columns':
+        copy_filename = copy_filename + 'c'
+        save_grid = saveGridToColumns
     print('\nsaving a copy of the grid to ' + copy_filename)
-    if savefile: saveGridToNPZ(copy_filename, grid_data, grid_size, xscale, length_to_cm, mass_to_g, time_to_s, sim_time, omega, adiabatic_index, nspecies, epsilon_2, [s + '_outflow' for s in outflow_fields], [a * b for a, b in zip(outflows, outflow_conversions)])
+    if savefile: save_grid(copy_filename, grid_data, grid_size, xscale, length_to_cm, mass_to_g, time_to_s, sim_time, omega, adiabatic_index, nspecies, epsilon_2, [s + '_outflow' for s in outflow_fields], [a * b for a, b in zip(outflows, outflow_conversions)])
     print('a copy was saved successfully!\n')
+    if max_level is not None:
+        # the copy above keeps every level, only the dataset is coarsened
+        print('restricting leaves finer than level', max_level, '...')
+        grid_data = restrict_grids(grid_data, max_level)
+        grid_size = 8*2**min(min_level, max_level)
 #        return grid_data
     bbox = np.array([[-1.0, 1.0], [-1.0, 1.0], [-1.0, 1.0]])
     print('\nloading dataset...')
@@ -378,40 +345,327 @@ def octo2yt_amr(filename, nspecies=1, epsilon_2=0.001, gather_outflows=True, cop
         #yt.add_field(('gas','velocity_z_rot'), function=_velocity_z_rot, units="cm/s", take_log=False,
         #            display_name=r'v_z^{\rm rot}', sampling_type="cell", force_override=True)
     return ds#, grid_data
+def get_data_files(filename, f, leaf_count):
+    # (path, leaf count) of every file holding leaves; a count of None is worked out from the file itself
+    import os
+    if len(f['.silo']) < 100:
+        data_files = [(filename + '.data/0.silo', None)]
+    else:
+        data_files = [(filename, leaf_count)]
+    io_file = 1
+    while os.path.exists(filename + '.data/'+str(io_file)+'.silo'):
+        data_files.append((filename + '.data/'+str(io_file)+'.silo', None))
+        io_file = io_file + 1
+    return data_files
+class LazyField(object):
+    # A leaf field that is only pulled from disk the first time it is used. shape and dtype are
+    # known up front; anything else (indexing, np.asarray, ufuncs, array attributes) reads it.
+    def __init__(self, load, shape, dtype):
+        self.load = load
+        self.shape = tuple(shape)
+        self.dtype = dtype
+        self.ndim = len(self.shape)
+        self.size = int(np.prod(self.shape))
+        self._data = None
+    def read(self):
+        if self._data is None:
+            self._data = self.load()
+        return self._data
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None:
+            return self.read()
+        return self.read().astype(dtype)
+    def __getitem__(self, key):
+        return self.read()[key]
+    def __len__(self):
+        return self.shape[0]
+    def __getattr__(self, name):
+        if name.startswith('__') or name in ('load', '_data'):
+            raise AttributeError(name)
+        return getattr(self.read(), name)
+def read_transposed(data_file, name):
+    # opens the file only for the read, so no HDF5 handle outlives it
+    import h5py
+    f_data = h5py.File(data_file, "r")
+    data = np.transpose(np.array(f_data['.silo'][name]), (2,1,0))
+    f_data.close()
+    return data
+def species_density(rho):
+    tmpDens = np.zeros(np.shape(rho[0]))
+    for i in range(0, len(rho)):
+        tmpDens = tmpDens + np.asarray(rho[i])
+    return tmpDens
+def species_number_density(rho, n_factor):
+    # plain array like the non-lazy 'n': total density times 1/(mu m_H) in 1/g
+    return np.multiply(species_density(rho), n_factor)
+def select_fields(fields, yt_fields, nspecies):
+    # raw fields that have to be read for the requested ones ('density' and 'n' need every species)
+    if fields is None:
+        return list(yt_fields)
+    read_fields = [key for key in fields if key in yt_fields]
+    if 'density' in fields or 'n' in fields:
+        read_fields += ['rho_'+str(i+1) for i in range(0, nspecies) if 'rho_'+str(i+1) not in read_fields]
+    return read_fields
+def iter_silo_file(data_file, cur_leaf_count, hdf5_fields, octo_fields, yt_fields, xscale, length_to_cm, read_fields=None, lazy=False, nspecies=0, derived=(), chunk_leaves=256, geometry=None, select=None, outflow_fields=None, file_info=None):
+    # Yields the leaves of a single Silo file as dicts of edges, level, dimensions and (x,y,z) ordered field
+    # arrays; only read_fields are read, and with lazy=True they are LazyFields (which reopen the file to read).
+    # derived may ask for the total 'density' and number density 'n' summed over nspecies species.
+    # Leaves are read chunk_leaves at a time: each field of a chunk is read_direct()-ed into one
+    # preallocated (leaf, z, y, x) block and the leaves get transposed views of it, so the hot loop
+    # does no per-leaf allocation or copy. geometry (the file's part of the leaf index) saves re-reading
+    # the coordinates, and select restricts the read to those leaf numbers of the file. The dict file_info,
+    # if given, gets the file's leaf 'geometry' and, with outflow_fields, its 'outflows' (see outflow_totals).
+    import numpy as np
+    import h5py
+    from functools import partial
+    f_data = h5py.File(data_file, "r")
+    if file_info is None:
+        file_info = {}
+    if outflow_fields is not None:
+        file_info['outflows'] = outflow_totals(f_data, outflow_fields)
+    hdf5_data = f_data['.silo']
+    field_round = len(hdf5_fields) + 3
+    number_of_fields = len(hdf5_fields)
+    if cur_leaf_count is None:
+        cur_leaf_count = len(list(hdf5_data.keys())) / field_round
+    cur_leaf_count = int(cur_leaf_count)
+    if geometry is None:
+        geometry = read_leaf_geometry(hdf5_data, cur_leaf_count, field_round, xscale * length_to_cm)
+    file_info['geometry'] = geometry
+    left_edge, right_edge, level, dimensions = geometry
+    if select is None:
+        select = np.arange(cur_leaf_count)
+    # (field, position of its dataset within a leaf) of everything that has to be read
+    to_read = []
+    for field in range (0, number_of_fields):
+        cur_field_name = hdf5_fields[field]
+        if octo_fields.count(cur_field_name) > 0:
+            key = yt_fields[octo_fields.index(cur_field_name)]
+            if read_fields is None or key in read_fields:
+                to_read.append((key, field + 4))
+    species = ['rho_'+str(i+1) for i in range(0, nspecies)]
+    if cur_leaf_count > 0 and not np.all(dimensions == dimensions[0]):
+        chunk_leaves = 1
+    if 'n' in derived:
+        import yt
+        mu = 1.008
+        n_factor = 1.0 / mu / yt.physical_constants.mass_hydrogen.in_units('g').v
+    for start in range(0, len(select), chunk_leaves):
+        leaves = select[start:start + chunk_leaves]
+        blocks = {}
+        for key, pos in to_read:
+            datasets = [hdf5_data['#'+str(leaf * field_round + pos).zfill(6)] for leaf in leaves]
+            if lazy:
+                blocks[key] = [LazyField(partial(read_transposed, data_file, dset.name[dset.name.rfind('/')+1:]), dset.shape[::-1], dset.dtype) for dset in datasets]
+                continue
+            block = np.empty((len(datasets),) + datasets[0].shape, dtype=datasets[0].dtype)
+            for i in range(0, len(datasets)):
+                datasets[i].read_direct(block[i])
+            blocks[key] = block
+        if 'density' in derived or 'n' in derived:
+            if lazy:
+                rho = list(zip(*[blocks[key] for key in species]))
+                if 'density' in derived:
+                    blocks['density'] = [LazyField(partial(species_density, r), r[0].shape, np.float64) for r in rho]
+                if 'n' in derived:
+                    blocks['n'] = [LazyField(partial(species_number_density, r, n_factor), r[0].shape, np.float64) for r in rho]
+            else:
+                dens = blocks[species[0]].astype(np.float64)
+                for key in species[1:]:
+                    dens += blocks[key]
+                if 'n' in derived:
+                    blocks['n'] = np.multiply(dens, n_factor)
+                if 'density' in derived:
+                    blocks['density'] = dens
+        for i, leaf in enumerate(leaves):
+            cur_leaf = dict(left_edge=list(left_edge[leaf]),
+            right_edge=list(right_edge[leaf]),
+            level = int(level[leaf]),
+            dimensions=[int(n) for n in dimensions[leaf]])
+            for key in blocks:
+                if lazy:
+                    cur_leaf[key] = blocks[key][i]
+                else:
+                    cur_leaf[key] = blocks[key][i].transpose(2,1,0)
+            yield cur_leaf
+    f_data.close()
+def read_leaf_geometry(hdf5_data, cur_leaf_count, field_round, denom):
+    # Edges (box units), level and dimensions of every leaf of a file. Each coordinate dataset is
+    # read once, and the edges are snapped onto the integer lattice of the leaf's level in one
+    # vectorized step: a level l cell is 2**-(l+2) wide, so the edges are exact dyadic numbers.
+    import numpy as np
+    first = np.zeros((cur_leaf_count, 3))
+    second = np.zeros((cur_leaf_count, 3))
+    dimensions = np.zeros((cur_leaf_count, 3), dtype=np.int64)
+    for leaf in range(0, cur_leaf_count):
+        for ax in range(0, 3):
+            vec = hdf5_data['#'+str(leaf * field_round + 1 + ax).zfill(6)][()]
+            first[leaf,ax] = vec[0]
+            second[leaf,ax] = vec[1]
+            dimensions[leaf,ax] = vec.shape[0] - 1
+    level = np.rint(-np.log2((second[:,0] - first[:,0]) / denom)).astype(np.int64) - 2
+    width = 2.0**(-2 - level.astype(np.float64))[:,None]
+    index = np.rint((first / denom + 1.0) / width).astype(np.int64)
+    left_edge = index * width - 1.0
+    right_edge = (index + dimensions) * width - 1.0
+    return left_edge, right_edge, level, dimensions
+def read_silo_leaves(data_file, cur_leaf_count, hdf5_fields, octo_fields, yt_fields, units, nspecies, xscale, length_to_cm, pbar=None, fields=None, geometry=None, select=None, outflow_fields=None):
+    # converts the leaves of a single Silo file into yt grid dicts (runs in the worker processes of octo2yt_amr);
+    # returns them with the file_info of iter_silo_file (leaf geometry and outflow totals of outflow_fields)
+    info = {}
+    read_fields = select_fields(fields, yt_fields, nspecies)
+    derived = [key for key in ['density', 'n'] if fields is None or key in fields]
+    dens_unit = units[octo_fields.index('rho_1')]
+    derived_units = dict(density=dens_unit, n=dens_unit+'/g')
+    grid_data = []
+    for cur_grid in iter_silo_file(data_file, cur_leaf_count, hdf5_fields, octo_fields, yt_fields, xscale, length_to_cm, read_fields, False, nspecies, derived,
+                                   geometry=geometry, select=select, outflow_fields=outflow_fields, file_info=info):
+        for ind in range(0, len(octo_fields)):
+            if yt_fields[ind] in cur_grid:
+                cur_grid[yt_fields[ind]] = (cur_grid[yt_fields[ind]], units[ind])
+        for key in derived:
+            cur_grid[key] = (cur_grid[key], derived_units[key])
+        if pbar is not None:
+            pbar.update(1)
+        grid_data.append(cur_grid)
+    return grid_data, info
+def iter_leaves(filename, nspecies=5, batch_size=1, fields=None, lazy=False, region=None):
+    # Streams the leaves of a snapshot one (or batch_size) at a time, so reductions over the
+    # whole snapshot only ever hold a single batch in memory. Every leaf is a dict with
+    # left_edge, right_edge (box units, [-1,1]), level, dimensions and plain numpy arrays
+    # (LazyFields with lazy=True) for each requested field, plus the total 'density'.
+    # region (see leaves_in_region) only reads the leaves that intersect it.
+    layout = read_layout(filename, nspecies)
+    read_fields = select_fields(fields, layout['yt_fields'], nspecies)
+    derived = ['density'] if fields is None or 'density' in fields else []
+    batch = []
+    for data_file, cur_leaf_count, geometry, select in index_by_file(filename, layout, region):
+        for leaf in iter_silo_file(data_file, cur_leaf_count, layout['hdf5_fields'], layout['octo_fields'], layout['yt_fields'],
+                                   layout['xscale'], layout['length_to_cm'], read_fields, lazy, nspecies, derived,
+                                   geometry=geometry, select=select):
+            if batch_size == 1:
+                yield leaf
+                continue
+            batch.append(leaf)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+    if len(batch) > 0:
+        yield batch
+LEAF_INDEX_KEYS = ['left_edge', 'right_edge', 'level', 'dimensions']
+def leaf_index_stamps(filename, layout):
+    import numpy as np
+    return np.array([file_stamp(filename)] + [file_stamp(d[0]) for d in layout['data_files']])
+def load_leaf_index(filename, layout):
+    # the leaf index of filename.leaves.npz, None if there is none or it is out of date
+    import numpy as np
+    import os
+    index_file = filename + '.leaves.npz'
+    if not os.path.exists(index_file):
+        return None
+    index = dict(np.load(index_file))
+    stamps = leaf_index_stamps(filename, layout)
+    if index['stamps'].shape == stamps.shape and np.all(index['stamps'] == stamps):
+        return index
+    return None
+def save_leaf_index(filename, layout, geometries):
+    # leaf index from the read_leaf_geometry of every data file (in layout order), written to filename.leaves.npz
+    import numpy as np
+    index = {}
+    for k, key in enumerate(LEAF_INDEX_KEYS):
+        index[key] = np.concatenate([geometry[k] for geometry in geometries])
+    index['file'] = np.concatenate([np.full(len(geometry[2]), i) for i, geometry in enumerate(geometries)])
+    index['leaf'] = np.concatenate([np.arange(len(geometry[2])) for geometry in geometries])
+    index['stamps'] = leaf_index_stamps(filename, layout)
+    try:
+        np.savez(filename + '.leaves.npz', **index)
+    except OSError:
+        print('could not write the leaf index ' + filename + '.leaves.npz')
+    return index
+def read_leaf_index(filename, layout):
+    # Bounding box, level and dimensions of every leaf (box units) with the file and position it is
+    # stored at. Built from the coordinate datasets alone the first time a snapshot is read, then
+    # kept in filename.leaves.npz, keyed like the header sidecar by the size/mtime of the files.
+    # (octo2yt_amr builds it from the geometry its workers read with the leaves instead.)
+    import h5py
+    index = load_leaf_index(filename, layout)
+    if index is not None:
+        return index
+    print('building the leaf index...')
+    field_round = len(layout['hdf5_fields']) + 3
+    geometries = []
+    for data_file, cur_leaf_count in layout['data_files']:
+        f_data = h5py.File(data_file, "r")
+        if cur_leaf_count is None:
+            cur_leaf_count = len(list(f_data['.silo'].keys())) / field_round
+        geometries.append(read_leaf_geometry(f_data['.silo'], int(cur_leaf_count), field_round, layout['xscale'] * layout['length_to_cm']))
+        f_data.close()
+    return save_leaf_index(filename, layout, geometries)
+def leaves_in_region(left_edge, right_edge, region, length_unit):
+    # Leaves whose box intersects region, either ('sphere', center, radius) or ('box', left, right),
+    # given in cm with the box center at the origin (the same coordinates as load_cell_table).
+    import numpy as np
+    left_edge = np.asarray(left_edge, dtype=np.float64)
+    right_edge = np.asarray(right_edge, dtype=np.float64)
+    if region[0] == 'sphere':
+        center = np.asarray(region[1], dtype=np.float64) / length_unit
+        radius = region[2] / length_unit
+        closest = np.clip(center, left_edge, right_edge)
+        return np.sum((closest - center)**2, axis=1) <= radius**2
+    if region[0] == 'box':
+        left = np.asarray(region[1], dtype=np.float64) / length_unit
+        right = np.asarray(region[2], dtype=np.float64) / length_unit
+        return np.all((left_edge < right) & (right_edge > left), axis=1)
+    raise ValueError("region must be ('sphere', center, radius) or ('box', left, right)")
+def index_by_file(filename, layout, region=None):
+    # (file, leaf count, geometry, leaves to read) for every file, from the leaf index
+    import numpy as np
+    index = read_leaf_index(filename, layout)
+    keep = np.ones(len(index['level']), dtype=bool)
+    if region is not None:
+        keep = leaves_in_region(index['left_edge'], index['right_edge'], region, layout['xscale'] * layout['length_to_cm'])
+        print('reading', np.sum(keep), 'of', len(keep), 'leaves inside the region')
+    files = []
+    for i, (data_file, cur_leaf_count) in enumerate(layout['data_files']):
+        in_file = index['file'] == i
+        geometry = tuple(index[key][in_file] for key in LEAF_INDEX_KEYS)
+        files.append((data_file, len(geometry[2]), geometry, index['leaf'][in_file & keep]))
+    return files
+def process_pool(nprocs):
+    # fork where available so that calling scripts without a __main__ guard are not re-run by the workers
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return ProcessPoolExecutor(nprocs, mp_context=multiprocessing.get_context('fork'))
+    return ProcessPoolExecutor(nprocs)
 def get_outflows(f):
-    keys = list(f.keys())
-    fields_name = []
-    fields_value = []
-    for i in range(0, len(keys)):
-    #    print i, len(keys)
-        if keys[i].isnumeric():
-            tt=f[keys[i]]
-            n_keys = list(tt.keys())
-            for j in range(0, len(n_keys)):
-                if '_outflow' in n_keys[j]:
-                    fields_name.append(n_keys[j])
-                    fields_value.append(tt[n_keys[j]][0])
-    import numpy as np
-    names = np.unique(fields_name)
-    sums = []
-    for i in range(0, len(names)):
-    #    print i
-        inds = np.where(np.array(fields_name) == names[i])
-        #print i, names[i]
-        #print inds, np.array(fields_value)[inds[0]]
-        sums.append(np.array(fields_value)[inds[0]].sum())
-    return names, np.array(sums)        
+    import numpy as np
+    totals = {}
+    for key in f.keys():
+        if key.isnumeric():
+            tt = f[key]
+            for name in tt.keys():
+                if '_outflow' in name:
+                    totals[name] = totals.get(name, 0) + tt[name][0]
+    names = np.array(sorted(totals))
+    return names, np.array([totals[name] for name in names])
+def outflow_totals(f, fields_name):
+    # Sums the <field>_outflow scalars of every numeric group of an open Silo file. Every scalar is a
+    # dataset of its own, so this is one small read per group and field; octo2yt_amr does it while the
+    # file is open for the leaves anyway.
+    import numpy as np
+    groups = [f[key] for key in f.keys() if key.isnumeric()]
+    names = [name + '_outflow' for name in fields_name]
+    values = np.zeros((len(groups), len(names)))
+    for i in range(0, len(groups)):
+        for j in range(0, len(names)):
+            groups[i][names[j]].read_direct(values[i], np.s_[0:1], np.s_[j:j+1])
+    return dict(zip(fields_name, values.sum(axis=0)))
 def get_outflows_f(f, fields_name):
-#    import sys
-    from tqdm import tqdm
-    print(' reading outflows from', f.filename[f.filename.rfind('/')+1:], '...')
-    keys = list(f.keys())
     import numpy as np
-    fields_value = np.zeros(len(fields_name))
-    for i in tqdm(list(range(0, len(keys)))):
-        if keys[i].isnumeric():
-            for j in range(0, len(fields_name)):
-                fields_value[j] = fields_value[j] + f[keys[i]][fields_name[j]+'_outflow'][0]
+    print(' reading outflows from', f.filename[f.filename.rfind('/')+1:], '...')
+    totals = outflow_totals(f, fields_name)
+    fields_value = np.array([totals[name] for name in fields_name])
     print(' outflows have been read successfully!\n')
     print(' outflows values:')
     for i in range(0, len(fields_name)):
@@ -443,11 +697,18 @@ def check_hdf5(filename):
     del f_data
     del h5py
     gc.collect()
+def _cell_kernel(data, kernel, *args):
+    # runs an octo_kernels kernel on the raw cgs values of the chunk's conserved fields
+    import numpy as np
+    shape = data['density'].shape
+    raw = [np.ravel(data[key].in_cgs().d) for key in ['egas', 'sx', 'sy', 'sz', 'density', 'tau']]
+    return kernel(*(raw + list(args))).reshape(shape)
 def _etot(field, data):
-    return data["eint"] + 0.5 * (data['velocity_x']**2 + data['velocity_y']**2 + data['velocity_z']**2)
+    import octo_kernels as ok
+    return data.ds.arr(_cell_kernel(data, ok.specific_total_energy, data.ds.parameters['gamma'], data.ds.parameters['epsilon_2']), 'erg/g')
 def _eint(field, data):
-    adiabatic_index = data.ds.parameters['gamma']
-    return data["pressure"] / (adiabatic_index-1) / data["density"]
+    import octo_kernels as ok
+    return data.ds.arr(_cell_kernel(data, ok.specific_internal_energy, data.ds.parameters['gamma'], data.ds.parameters['epsilon_2']), 'erg/g')
 def _velocity_x(field, data):
     return data["sx"] / data["density"]
 def _velocity_y(field, data):
@@ -461,24 +722,11 @@ def _velocity_y_rot(field, data):
 def _velocity_z_rot(field, data):
     return data["velocity_z"]
 def _pressure(field, data):
-    import yt
-    adiabatic_index = data.ds.parameters['gamma']
-    epsilon_2 = data.ds.parameters['epsilon_2']
-    ei = data['egas'] - 0.5 * (data['sx']**2 + data['sy']**2 + data['sz']**2) / data['density']
-    ei_dual = data['tau'].v**adiabatic_index * yt.units.erg / yt.units.cm**3
-    return (adiabatic_index-1) * ((ei <= epsilon_2 * data['egas']) * ei_dual + (ei > epsilon_2 * data['egas']) * ei)                
+    import octo_kernels as ok
+    return data.ds.arr(_cell_kernel(data, ok.pressure, data.ds.parameters['gamma'], data.ds.parameters['epsilon_2']), 'erg/cm**3')
 def _temperature(field, data):
-    import yt
-    A = 6.002565788159526e+22 * yt.units.erg * yt.units.cm**-3
-    B = 1962085.0342234566 * yt.units.g * yt.units.cm**-3
-    x = (data['density'] / B) ** (1/3)
-    edeg = A*(8*(x)**3*(((x)**2+1)**0.5-1)-((x)*(2*(x)**2-3)*((x)**2+1)**0.5)+3*np.arcsinh(x))
-    ek = 0.5 * (data['sy']**2 + data['sy']**2 + data['sz']**2) / data['density']
-    epsilon_2 = data.ds.parameters['epsilon_2']
-    eint = (data['egas'] - ek - edeg) * ((data['egas'] - ek - edeg) >= epsilon_2 * data['egas']) \
-        + (np.array(data['tau']**(5/3))*yt.units.erg * yt.units.cm**-3) * ((data['egas'] - ek - edeg) < epsilon_2 * data['egas'])
-    
-    return (eint/data['density']*(4/3)*yt.physical_constants.mass_hydrogen_cgs/yt.physical_constants.boltzmann_constant_cgs) * (eint > 0)
+    import octo_kernels as ok
+    return data.ds.arr(_cell_kernel(data, ok.temperature, data.ds.parameters['epsilon_2']), 'K')
     #return data['pressure'] / data['n'] / yt.physical_constants.boltzmann_constant_cgs
 def _gpot(field, data):
     return data['pot'] / data['density']
@@ -576,9 +824,11 @@ def YTDataSetToAMRGrid(ds):
 def saveGridToNPZ(filename, g, grid_size, xscale, length_to_cm, mass_to_g, time_to_s, sim_time, omega, adiabatic_index, nspecies, epsilon_2, outflows_names, outflows):
     import numpy as np
     np.savez_compressed(filename, grid_data=g, grid_size=grid_size, xscale=xscale, length_to_cm=length_to_cm, mass_to_g=mass_to_g, time_to_s=time_to_s, sim_time=sim_time, omega=omega, adiabatic_index=adiabatic_index, nspecies=nspecies, epsilon_2=epsilon_2, outflows_names=outflows_names, outflows=outflows, allow_pickle=True)
-def loadFromNPZ(filename, encoded_in="3"):
+def loadFromNPZ(filename, encoded_in="3", region=None, max_level=None):
     import numpy as np
-    import yt
+    import os
+    if os.path.isdir(filename):
+        return loadFromColumns(filename, region=region, max_level=max_level)
     if encoded_in == "2":
         pf = np.load(filename, allow_pickle=True, encoding="latin1")
     if encoded_in == "3":
@@ -587,6 +837,12 @@ def loadFromNPZ(filename, encoded_in="3"):
     grid_size = pf['grid_size'].item()
     xscale = pf['xscale'].item()
     length_to_cm = pf['length_to_cm'].item()
+    if region is not None:
+        keep = leaves_in_region([g['left_edge'] for g in grid_data], [g['right_edge'] for g in grid_data], region, xscale * length_to_cm)
+        grid_data = [g for g, k in zip(grid_data, keep) if k]
+    if max_level is not None:
+        grid_data = restrict_grids(grid_data, max_level)
+        grid_size = min(grid_size, 8*2**max_level)
     mass_to_g = pf['mass_to_g'].item()
     time_to_s = pf['time_to_s'].item()
     sim_time = pf['sim_time'].item()
@@ -596,7 +852,10 @@ def loadFromNPZ(filename, encoded_in="3"):
     epsilon_2 = pf['epsilon_2'].item()
     outflows_names = pf['outflows_names']
     outflows = pf['outflows']
-
+    return make_octo_ds(filename, grid_data, grid_size, xscale, length_to_cm, mass_to_g, time_to_s, sim_time, omega, adiabatic_index, nspecies, epsilon_2, outflows_names, outflows)
+def make_octo_ds(filename, grid_data, grid_size, xscale, length_to_cm, mass_to_g, time_to_s, sim_time, omega, adiabatic_index, nspecies, epsilon_2, outflows_names, outflows):
+    import numpy as np
+    import yt
     bbox = np.array([[-1.0, 1.0], [-1.0, 1.0], [-1.0, 1.0]])
     ds = yt.load_amr_grids(grid_data, [grid_size, grid_size, grid_size], bbox=bbox, length_unit = xscale * length_to_cm, sim_time=sim_time)
     ds.mass_unit = mass_to_g * yt.units.g
@@ -613,6 +872,504 @@ def loadFromNPZ(filename, encoded_in="3"):
         ds.parameters[outflows_names[i]] = outflows[i]
     add_octo_derived_fields()
     return ds
+# Columnar cache: a directory with one flat .npy array per field (all leaves back to back, each leaf
+# in C order of its (x,y,z) layout), a grid table (grids.npz) and the run parameters (meta.npz).
+# Nothing is pickled or compressed, so loadFromColumns can memory-map the fields.
+GRID_KEYS = ['left_edge', 'right_edge', 'level', 'dimensions']
+def saveGridToColumns(dirname, g, grid_size, xscale, length_to_cm, mass_to_g, time_to_s, sim_time, omega, adiabatic_index, nspecies, epsilon_2, outflows_names, outflows):
+    import numpy as np
+    import os
+    os.makedirs(dirname, exist_ok=True)
+    fields = [key for key in g[0] if key not in GRID_KEYS]
+    units = [g[0][key][1] for key in fields]
+    dimensions = np.array([grid['dimensions'] for grid in g], dtype=np.int64)
+    sizes = np.prod(dimensions, axis=1)
+    offset = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    np.savez(dirname + '/grids.npz', left_edge=np.array([grid['left_edge'] for grid in g], dtype=np.float64),
+             right_edge=np.array([grid['right_edge'] for grid in g], dtype=np.float64),
+             level=np.array([grid['level'] for grid in g], dtype=np.int64), dimensions=dimensions, offset=offset)
+    np.savez(dirname + '/meta.npz', fields=np.array(fields), units=np.array(units), grid_size=grid_size, xscale=xscale,
+             length_to_cm=length_to_cm, mass_to_g=mass_to_g, time_to_s=time_to_s, sim_time=sim_time, omega=omega,
+             adiabatic_index=adiabatic_index, nspecies=nspecies, epsilon_2=epsilon_2,
+             outflows_names=np.array(outflows_names), outflows=np.array(outflows, dtype=np.float64))
+    # one field at a time, so only a single column is ever dirty in memory
+    for key in fields:
+        col = np.lib.format.open_memmap(dirname + '/' + key + '.npy', mode='w+', dtype=np.float64, shape=(int(np.sum(sizes)),))
+        for i, grid in enumerate(g):
+            col[offset[i]:offset[i]+sizes[i]] = np.ravel(np.asarray(grid[key][0]))
+        col.flush()
+        del col
+def loadColumns(dirname, fields=None):
+    # memory-mapped columns and grid table of a saveGridToColumns cache, nothing is read until touched
+    import numpy as np
+    meta = dict(np.load(dirname + '/meta.npz'))
+    grids = dict(np.load(dirname + '/grids.npz'))
+    if fields is None:
+        fields = list(meta['fields'])
+    units = dict(zip(meta['fields'], meta['units']))
+    columns = {}
+    for key in fields:
+        columns[key] = (np.load(dirname + '/' + key + '.npy', mmap_mode='r'), str(units[key]))
+    return meta, grids, columns
+def loadFromColumns(dirname, fields=None, region=None, max_level=None):
+    import numpy as np
+    meta, grids, columns = loadColumns(dirname, fields)
+    keep = np.ones(len(grids['level']), dtype=bool)
+    if region is not None:
+        keep = leaves_in_region(grids['left_edge'], grids['right_edge'], region, meta['xscale'].item() * meta['length_to_cm'].item())
+    grid_data = []
+    for i in np.where(keep)[0]:
+        dims = tuple(grids['dimensions'][i])
+        off = grids['offset'][i]
+        size = dims[0] * dims[1] * dims[2]
+        cur_grid = dict(left_edge=list(grids['left_edge'][i]), right_edge=list(grids['right_edge'][i]),
+                        level=int(grids['level'][i]), dimensions=list(dims))
+        for key in columns:
+            # a reshaped slice of the memmap is a view, yt pages the data in when it reads the field
+            cur_grid[key] = (columns[key][0][off:off+size].reshape(dims), columns[key][1])
+        grid_data.append(cur_grid)
+    grid_size = meta['grid_size'].item()
+    if max_level is not None:
+        grid_data = restrict_grids(grid_data, max_level)
+        grid_size = min(grid_size, 8*2**max_level)
+    return make_octo_ds(dirname, grid_data, grid_size, meta['xscale'].item(), meta['length_to_cm'].item(),
+                        meta['mass_to_g'].item(), meta['time_to_s'].item(), meta['sim_time'].item(), meta['omega'].item(),
+                        meta['adiabatic_index'].item(), meta['nspecies'].item(), meta['epsilon_2'].item(),
+                        meta['outflows_names'], meta['outflows'])
+# yt-free loading: a flat structure-of-arrays table with one entry per cell (x, y, z, dx and
+# cell_volume in cm, level, and every field), in leaf order with each leaf in (x,y,z) C order.
+def leaf_node_index(left_edge, level, dimensions):
+    # integer octree node index of each leaf at its own level (levels as in the grid dicts)
+    import numpy as np
+    width = 2.0**(-2 - np.asarray(level, dtype=np.float64))
+    cells = np.rint((np.asarray(left_edge) + 1.0) / width[:,None]).astype(np.int64)
+    return cells // np.asarray(dimensions, dtype=np.int64)
+def covered_cells(left_edge, right_edge, level, dimensions):
+    # Flags the cells lying under a finer leaf, the ones yt leaves out of all_data(). Octo-Tiger
+    # only writes leaves so this is normally empty and None is returned; the node keys below
+    # find candidate overlaps without comparing every pair of leaves.
+    import numpy as np
+    left_edge = np.asarray(left_edge, dtype=np.float64)
+    right_edge = np.asarray(right_edge, dtype=np.float64)
+    level = np.asarray(level, dtype=np.int64)
+    dimensions = np.asarray(dimensions, dtype=np.int64)
+    node = leaf_node_index(left_edge, level, dimensions)
+    base = level.min()
+    def node_key(lev, nd):
+        return ((lev - base) << 60) | (nd[:,0] << 40) | (nd[:,1] << 20) | nd[:,2]
+    own = node_key(level, node)
+    ancestors = []
+    for lev in range(base, level.max()):
+        finer = level > lev
+        ancestors.append(node_key(np.full(finer.sum(), lev), node[finer] >> (level[finer] - lev)[:,None]))
+    if len(ancestors) == 0:
+        return None
+    candidates = np.where(np.isin(own, np.concatenate(ancestors)))[0]
+    if len(candidates) == 0:
+        return None
+    sizes = np.prod(dimensions, axis=1)
+    offset = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    mask = np.zeros(np.sum(sizes), dtype=bool)
+    for i in candidates:
+        finer = np.where((level > level[i]) & np.all((left_edge < right_edge[i]) & (right_edge > left_edge[i]), axis=1))[0]
+        centers = [left_edge[i,ax] + (np.arange(dimensions[i,ax]) + 0.5) * (right_edge[i,ax] - left_edge[i,ax]) / dimensions[i,ax] for ax in range(3)]
+        leaf_mask = np.zeros(tuple(dimensions[i]), dtype=bool)
+        for j in finer:
+            inside = [(c > left_edge[j,ax]) & (c < right_edge[j,ax]) for ax, c in enumerate(centers)]
+            leaf_mask |= inside[0][:,None,None] & inside[1][None,:,None] & inside[2][None,None,:]
+        mask[offset[i]:offset[i]+sizes[i]] = leaf_mask.ravel()
+    return mask
+def cell_geometry(left_edge, right_edge, dimensions, length_unit):
+    # cell centers, widths and volumes (cm) of every leaf, in the same order as the field columns
+    import numpy as np
+    left_edge = np.asarray(left_edge, dtype=np.float64)
+    right_edge = np.asarray(right_edge, dtype=np.float64)
+    dimensions = np.asarray(dimensions, dtype=np.int64)
+    width = (right_edge - left_edge) / dimensions
+    cells = {}
+    if np.all(dimensions == dimensions[0]):
+        # all leaves have the same shape (always the case for Octo-Tiger), broadcast over every leaf at once
+        nx, ny, nz = dimensions[0]
+        shape = (len(left_edge), nx, ny, nz)
+        for ax, key, sl in [(0, 'x', (slice(None), slice(None), None, None)), (1, 'y', (slice(None), None, slice(None), None)),
+                            (2, 'z', (slice(None), None, None, slice(None)))]:
+            centers = left_edge[:,ax,None] + (np.arange(dimensions[0,ax]) + 0.5) * width[:,ax,None]
+            cells[key] = np.broadcast_to(centers[sl], shape).ravel() * length_unit
+        cells['dx'] = np.repeat(width[:,0], nx*ny*nz) * length_unit
+        cells['cell_volume'] = np.repeat(np.prod(width, axis=1), nx*ny*nz) * length_unit**3
+        return cells
+    for key in ['x', 'y', 'z', 'dx', 'cell_volume']:
+        cells[key] = []
+    for i in range(0, len(left_edge)):
+        nx, ny, nz = dimensions[i]
+        centers = [(left_edge[i,ax] + (np.arange(dimensions[i,ax]) + 0.5) * width[i,ax]) * length_unit for ax in range(3)]
+        x, y, z = np.meshgrid(centers[0], centers[1], centers[2], indexing='ij')
+        cells['x'].append(x.ravel())
+        cells['y'].append(y.ravel())
+        cells['z'].append(z.ravel())
+        cells['dx'].append(np.full(nx*ny*nz, width[i,0] * length_unit))
+        cells['cell_volume'].append(np.full(nx*ny*nz, np.prod(width[i]) * length_unit**3))
+    for key in cells:
+        cells[key] = np.concatenate(cells[key])
+    return cells
+def split_leaves(left_edge, right_edge, level, dimensions, data):
+    # flat columns -> list of leaf dicts (views into the columns)
+    import numpy as np
+    dimensions = np.asarray(dimensions, dtype=np.int64)
+    sizes = np.prod(dimensions, axis=1)
+    offset = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    leaves = []
+    for i in range(0, len(sizes)):
+        leaf = dict(left_edge=list(left_edge[i]), right_edge=list(right_edge[i]), level=int(level[i]), dimensions=[int(n) for n in dimensions[i]])
+        for key in data:
+            leaf[key] = data[key][offset[i]:offset[i]+sizes[i]].reshape(tuple(dimensions[i]))
+        leaves.append(leaf)
+    return leaves
+def join_leaves(leaves):
+    # list of leaf dicts -> geometry arrays and flat columns
+    import numpy as np
+    left_edge = np.array([leaf['left_edge'] for leaf in leaves])
+    right_edge = np.array([leaf['right_edge'] for leaf in leaves])
+    level = np.array([leaf['level'] for leaf in leaves])
+    dimensions = np.array([leaf['dimensions'] for leaf in leaves])
+    data = {}
+    for key in leaves[0]:
+        if key not in GRID_KEYS:
+            data[key] = np.concatenate([np.ravel(leaf[key]) for leaf in leaves])
+    return left_edge, right_edge, level, dimensions, data
+def restrict_grids(grid_data, max_level):
+    # Quick-look coarsening. Octo-Tiger only stores leaves, so a leaf finer than max_level is
+    # replaced by its ancestor octree node at max_level, built from the volume-weighted mean of
+    # the fine cells inside each coarse cell; cell volumes and integrals such as the total mass
+    # are unchanged. Works on yt grid dicts ((array, unit) fields) and plain leaf dicts alike.
+    import numpy as np
+    kept = []
+    parents = {}
+    for grid in grid_data:
+        if grid['level'] <= max_level:
+            kept.append(grid)
+            continue
+        dims = np.asarray(grid['dimensions'], dtype=np.int64)
+        width = 2.0**(-2 - grid['level'])
+        first = np.rint((np.asarray(grid['left_edge'], dtype=np.float64) + 1.0) / width).astype(np.int64)
+        coarse = [(first[ax] + np.arange(dims[ax])) >> (grid['level'] - max_level) for ax in range(3)]
+        node = tuple(int(coarse[ax][0] // dims[ax]) for ax in range(3))
+        local = np.ix_(*[coarse[ax] - node[ax] * dims[ax] for ax in range(3)])
+        if node not in parents:
+            parents[node] = dict(dimensions=dims, volume=np.zeros(tuple(dims)), sums={}, units={})
+        parent = parents[node]
+        np.add.at(parent['volume'], local, width**3)
+        for key in grid:
+            if key in GRID_KEYS:
+                continue
+            value, unit = grid[key] if isinstance(grid[key], tuple) else (grid[key], None)
+            if key not in parent['sums']:
+                parent['sums'][key] = np.zeros(tuple(dims))
+                parent['units'][key] = unit
+            np.add.at(parent['sums'][key], local, np.asarray(value) * width**3)
+    width = 2.0**(-2 - max_level)
+    for node in parents:
+        parent = parents[node]
+        dims = parent['dimensions']
+        left = np.array(node) * dims * width - 1.0
+        grid = dict(left_edge=list(left), right_edge=list(left + dims * width), level=max_level, dimensions=[int(n) for n in dims])
+        for key in parent['sums']:
+            mean = np.zeros(tuple(dims))
+            np.divide(parent['sums'][key], parent['volume'], out=mean, where=parent['volume'] > 0)
+            grid[key] = mean if parent['units'][key] is None else (mean, parent['units'][key])
+        kept.append(grid)
+    return kept
+def cell_chunk(left_edge, right_edge, level, dimensions, data, length_unit):
+    # geometry columns (cell_geometry), level and the flat field columns of a set of leaves
+    import numpy as np
+    cells = cell_geometry(left_edge, right_edge, dimensions, length_unit)
+    sizes = np.prod(np.asarray(dimensions, dtype=np.int64), axis=1)
+    cells['level'] = np.repeat(np.asarray(level, dtype=np.int64), sizes)
+    cells.update(data)
+    return cells
+def load_cell_table(filename, nspecies=5, fields=None, region=None, max_level=None):
+    # Silo snapshot, .ytc column cache or .yt.npz copy -> flat cell table, without importing yt;
+    # region (see leaves_in_region) keeps only the leaves intersecting it, max_level coarsens as restrict_grids
+    import numpy as np
+    import os
+    if os.path.isdir(filename):
+        meta, grids, columns = loadColumns(filename, fields)
+        left_edge, right_edge, level, dimensions = grids['left_edge'], grids['right_edge'], grids['level'], grids['dimensions']
+        length_unit = meta['xscale'].item() * meta['length_to_cm'].item()
+        data = {key: columns[key][0] for key in columns}
+        if region is not None:
+            keep = leaves_in_region(left_edge, right_edge, region, length_unit)
+            sizes = np.prod(dimensions, axis=1)
+            cell_ind = np.concatenate([np.arange(grids['offset'][i], grids['offset'][i] + sizes[i]) for i in np.where(keep)[0]] + [np.zeros(0, dtype=np.int64)])
+            data = {key: data[key][cell_ind] for key in data}
+            left_edge, right_edge, level, dimensions = left_edge[keep], right_edge[keep], level[keep], dimensions[keep]
+    elif filename.endswith('.npz'):
+        pf = np.load(filename, allow_pickle=True)
+        grid_data = pf['grid_data']
+        length_unit = pf['xscale'].item() * pf['length_to_cm'].item()
+        if region is not None:
+            keep = leaves_in_region([g['left_edge'] for g in grid_data], [g['right_edge'] for g in grid_data], region, length_unit)
+            grid_data = [g for g, k in zip(grid_data, keep) if k]
+        left_edge = [g['left_edge'] for g in grid_data]
+        right_edge = [g['right_edge'] for g in grid_data]
+        level = [g['level'] for g in grid_data]
+        dimensions = [g['dimensions'] for g in grid_data]
+        data = {}
+        for key in grid_data[0]:
+            if key not in GRID_KEYS and (fields is None or key in fields):
+                data[key] = np.concatenate([np.ravel(np.asarray(g[key][0])) for g in grid_data])
+    else:
+        layout = read_layout(filename, nspecies)
+        length_unit = layout['xscale'] * layout['length_to_cm']
+        left_edge, right_edge, level, dimensions = [], [], [], []
+        data = {}
+        for leaf in iter_leaves(filename, nspecies, fields=fields, region=region):
+            left_edge.append(leaf.pop('left_edge'))
+            right_edge.append(leaf.pop('right_edge'))
+            level.append(leaf.pop('level'))
+            dimensions.append(leaf.pop('dimensions'))
+            for key in leaf:
+                data.setdefault(key, []).append(leaf[key].ravel())
+        for key in data:
+            data[key] = np.concatenate(data[key])
+    if max_level is not None and len(level) > 0 and np.max(level) > max_level:
+        left_edge, right_edge, level, dimensions, data = join_leaves(restrict_grids(split_leaves(left_edge, right_edge, level, dimensions, data), max_level))
+    cells = cell_chunk(left_edge, right_edge, level, dimensions, data, length_unit)
+    mask = covered_cells(left_edge, right_edge, level, dimensions)
+    if mask is not None:
+        for key in cells:
+            cells[key] = cells[key][~mask]
+    return cells
+def iter_cell_table(filename, nspecies=5, fields=None, region=None, chunk_cells=2**22):
+    # load_cell_table one chunk of whole leaves (about chunk_cells cells) at a time, so reductions over
+    # a snapshot only hold a single chunk. Only the leaf geometry is read up front, to find covered cells.
+    import numpy as np
+    import os
+    chunk_leaves = max(2, chunk_cells // 512)
+    if os.path.isdir(filename):
+        meta, grids, columns = loadColumns(filename, fields)
+        length_unit = meta['xscale'].item() * meta['length_to_cm'].item()
+        leaves = np.arange(len(grids['level']))
+        if region is not None:
+            leaves = leaves[leaves_in_region(grids['left_edge'], grids['right_edge'], region, length_unit)]
+        geometry = [grids[key][leaves] for key in GRID_KEYS]
+        sizes = np.prod(grids['dimensions'], axis=1)
+        def chunks():
+            for start in range(0, len(leaves), chunk_leaves):
+                sel = leaves[start:start + chunk_leaves]
+                if sel[-1] - sel[0] == len(sel) - 1:
+                    cell_ind = slice(grids['offset'][sel[0]], grids['offset'][sel[-1]] + sizes[sel[-1]])
+                else:
+                    cell_ind = np.concatenate([np.arange(grids['offset'][i], grids['offset'][i] + sizes[i]) for i in sel])
+                yield [grids[key][sel] for key in GRID_KEYS], {key: np.array(columns[key][0][cell_ind]) for key in columns}
+    elif filename.endswith('.npz'):
+        pf = np.load(filename, allow_pickle=True)
+        grid_data = pf['grid_data']
+        length_unit = pf['xscale'].item() * pf['length_to_cm'].item()
+        if region is not None:
+            keep = leaves_in_region([g['left_edge'] for g in grid_data], [g['right_edge'] for g in grid_data], region, length_unit)
+            grid_data = [g for g, k in zip(grid_data, keep) if k]
+        geometry = [np.array([g[key] for g in grid_data]) for key in GRID_KEYS]
+        def chunks():
+            for start in range(0, len(grid_data), chunk_leaves):
+                part = grid_data[start:start + chunk_leaves]
+                data = {}
+                for key in part[0]:
+                    if key not in GRID_KEYS and (fields is None or key in fields):
+                        data[key] = np.concatenate([np.ravel(np.asarray(g[key][0])) for g in part])
+                yield [np.array([g[key] for g in part]) for key in GRID_KEYS], data
+    else:
+        layout = read_layout(filename, nspecies)
+        length_unit = layout['xscale'] * layout['length_to_cm']
+        index = read_leaf_index(filename, layout)
+        keep = np.ones(len(index['level']), dtype=bool)
+        if region is not None:
+            keep = leaves_in_region(index['left_edge'], index['right_edge'], region, length_unit)
+        geometry = [index[key][keep] for key in LEAF_INDEX_KEYS]
+        def chunks():
+            for batch in iter_leaves(filename, nspecies, batch_size=chunk_leaves, fields=fields, region=region):
+                left_edge, right_edge, level, dimensions, data = join_leaves(batch)
+                yield [left_edge, right_edge, level, dimensions], data
+    mask = covered_cells(*geometry) if len(geometry[2]) > 0 else None
+    pos = 0
+    for grid, data in chunks():
+        cells = cell_chunk(grid[0], grid[1], grid[2], grid[3], data, length_unit)
+        n = len(cells['x'])
+        if mask is not None:
+            for key in cells:
+                cells[key] = cells[key][~mask[pos:pos+n]]
+        pos += n
+        yield cells
+def deposit_leaf(out, left_edge, leaf_level, value, level, x_range=None):
+    # Adds one leaf (x,y,z ordered values, box units) onto out, the uniform grid of a level over [-1,1].
+    # Coarser leaves are broadcast onto the cells they cover (no upsampled copy), finer ones enter as
+    # volume-weighted means. x_range=(x0, x1) only writes the out cells x0 <= x < x1 (a slab).
+    import numpy as np
+    value = np.asarray(value)
+    shift = leaf_level - level
+    first = np.rint((np.asarray(left_edge, dtype=np.float64) + 1.0) / 2.0**(-2 - leaf_level)).astype(np.int64)
+    if shift <= 0:
+        f = 2**-shift
+        lo = first * f
+        if x_range is not None:
+            # leaf cells starting inside the slab
+            i0 = max(0, -(-(x_range[0] - lo[0]) // f))
+            i1 = min(value.shape[0], -(-(x_range[1] - lo[0]) // f))
+            if i1 <= i0:
+                return
+            value = value[i0:i1]
+            lo[0] = lo[0] + i0 * f
+        nx, ny, nz = value.shape
+        view = out[lo[0]:lo[0]+nx*f, lo[1]:lo[1]+ny*f, lo[2]:lo[2]+nz*f].reshape(nx, f, ny, f, nz, f)
+        view[...] = value[:,None,:,None,:,None]
+        return
+    coarse = [(first[ax] + np.arange(value.shape[ax])) >> shift for ax in range(0, 3)]
+    if x_range is not None:
+        inside = (coarse[0] >= x_range[0]) & (coarse[0] < x_range[1])
+        if not inside.any():
+            return
+        value = value[inside]
+        coarse[0] = coarse[0][inside]
+    lo = [c[0] for c in coarse]
+    block = np.zeros([c[-1] - c[0] + 1 for c in coarse])
+    np.add.at(block, np.ix_(*[coarse[ax] - lo[ax] for ax in range(0, 3)]), value)
+    out[lo[0]:lo[0]+block.shape[0], lo[1]:lo[1]+block.shape[1], lo[2]:lo[2]+block.shape[2]] += block / 8**shift
+def deposit_field(path, key, files, layout, nspecies, level, x_range=None):
+    # fills the uniform-grid file of a single field, or its slab x_range (runs in the worker processes of octo2uniform)
+    from numpy.lib.format import open_memmap
+    out = open_memmap(path, mode='r+')
+    derived = [key] if key in ['density', 'n'] else []
+    read_fields = select_fields([key], layout['yt_fields'], nspecies)
+    for data_file, cur_leaf_count, geometry, select in files:
+        for leaf in iter_silo_file(data_file, cur_leaf_count, layout['hdf5_fields'], layout['octo_fields'], layout['yt_fields'],
+                                   layout['xscale'], layout['length_to_cm'], read_fields, False, nspecies, derived,
+                                   geometry=geometry, select=select):
+            deposit_leaf(out, leaf['left_edge'], leaf['level'], leaf[key], level, x_range)
+    out.flush()
+    del out
+    return key
+def slab_files(files, level, x_range):
+    # the index_by_file entries restricted to the leaves overlapping the out cells x_range[0] <= x < x_range[1]
+    import numpy as np
+    width = 2.0**(-2 - level)
+    result = []
+    for data_file, cur_leaf_count, geometry, select in files:
+        start = np.floor((geometry[0][select,0] + 1.0) / width)
+        end = np.ceil((geometry[1][select,0] + 1.0) / width)
+        result.append((data_file, cur_leaf_count, geometry, select[(start < x_range[1]) & (end > x_range[0])]))
+    return result
+def octo2uniform(filename, level, outdir=None, fields=None, nspecies=5, dtype='float32', nprocs=1, region=None):
+    # Deposits a snapshot onto the uniform grid of one refinement level (8*2**level cells a side over the
+    # whole box) without holding it in memory: every field is written straight into its own memory-mapped
+    # <field>.npy in outdir (default filename.uniform<level>), next to a meta.npz with the units and scales.
+    # With nprocs > 1 the work is split into fields and, when there are fewer fields than processes, into
+    # x slabs of each field; slabs are aligned to the coarsest leaf cells, so no two tasks write the same
+    # cells (leaves crossing a slab border are read by both). Returns read-only memmaps.
+    import numpy as np
+    import os
+    from numpy.lib.format import open_memmap
+    layout = read_layout(filename, nspecies)
+    if fields is None:
+        fields = list(layout['yt_fields']) + ['density']
+    if outdir is None:
+        outdir = filename + '.uniform' + str(level)
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    grid_size = 8*2**level
+    dens_unit = layout['units'][layout['octo_fields'].index('rho_1')]
+    units = []
+    for key in fields:
+        if key in layout['yt_fields']:
+            units.append(layout['units'][layout['yt_fields'].index(key)])
+        else:
+            units.append(dict(density=dens_unit, n=dens_unit+'/g')[key])
+    np.savez(outdir + '/meta.npz', fields=np.array(fields), units=np.array(units), level=level, grid_size=grid_size,
+             xscale=layout['xscale'], length_to_cm=layout['length_to_cm'], mass_to_g=layout['mass_to_g'],
+             time_to_s=layout['time_to_s'], sim_time=layout['sim_time'], omega=layout['omega'])
+    print('\ndepositing', len(fields), 'fields onto a', str(grid_size)+'^3 grid in ' + outdir)
+    files = index_by_file(filename, layout, region)
+    paths = [outdir + '/' + key + '.npy' for key in fields]
+    for path in paths:
+        out = open_memmap(path, mode='w+', dtype=dtype, shape=(grid_size, grid_size, grid_size))
+        del out
+    if nprocs > 1:
+        # slab borders on multiples of the coarsest leaf cell, in cells of the uniform grid
+        align = 2**max(level - min([int(l) for l in read_leaf_index(filename, layout)['level']] + [level]), 0)
+        nslabs = max(1, min(-(-nprocs // len(fields)), grid_size // align))
+        bounds = [align * ((grid_size // align) * i // nslabs) for i in range(0, nslabs + 1)]
+        slabs = [((bounds[i], bounds[i+1]), slab_files(files, level, (bounds[i], bounds[i+1]))) for i in range(0, nslabs)]
+        with process_pool(nprocs) as pool:
+            jobs = [[pool.submit(deposit_field, path, key, slab, layout, nspecies, level, x_range) for x_range, slab in slabs]
+                    for path, key in zip(paths, fields)]
+            for key, field_jobs in zip(fields, jobs):
+                for job in field_jobs:
+                    job.result()
+                print(' -', key)
+    else:
+        for path, key in zip(paths, fields):
+            deposit_field(path, key, files, layout, nspecies, level)
+            print(' -', key)
+    return {key: np.load(path, mmap_mode='r') for path, key in zip(paths, fields)}
+OCTO_FIELDS = ['egas', 'sx', 'sy', 'sz', 'tau', 'lz', 'pot', 'gx', 'gy', 'gz']
+OUTFLOW_FIELDS = ['egas', 'sx', 'sy', 'sz', 'tau', 'lz', 'pot']
+def file_stamp(path):
+    import os
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+def read_layout(filename, nspecies=5, use_cache=True):
+    # Everything octo2yt_amr and iter_leaves need to know before touching the leaves. The result is
+    # kept in a small sidecar (filename.layout.json) keyed by the size/mtime of the snapshot files,
+    # so re-opening an unchanged snapshot skips the walk over the HDF5 namespace.
+    import numpy as np
+    import h5py
+    import json
+    import os
+    sidecar = filename + '.layout.json'
+    if use_cache and os.path.exists(sidecar):
+        with open(sidecar) as fp:
+            cached = json.load(fp)
+        layout = cached['layout']
+        n_files = len(layout['data_files'])
+        if cached['nspecies'] == nspecies and cached['stamps'] == [file_stamp(filename)] + [file_stamp(d[0]) for d in layout['data_files']] \
+                and not os.path.exists(filename + '.data/'+str(n_files)+'.silo'):
+            print('reading headers from ' + sidecar)
+            layout['hdf5_fields'] = np.array(layout['hdf5_fields'])
+            layout['data_files'] = [tuple(d) for d in layout['data_files']]
+            return layout
+    adiabatic_index = 5.0 / 3.0
+    f, hdf5_fields, fields_order, leaf_count, total_nodes, xscale, length_to_cm, time_to_s, mass_to_g, sim_time, omega, \
+        atomic_numbers, atomic_masses, Xs, Zs, \
+        spec_octo_fields, spec_units, spec_yt_fields, spec_outflow_fields, spec_outflow_conversions = read_headers(filename, nspecies)
+
+# tau is the entropy tracer defined by the internal energy density in power of the inverse of the adiabtic index (e^(1/gamma))
+    units = ['erg/cm**3', 'g/(s*cm**2)', 'g/(s*cm**2)', 'g/(s*cm**2)', '(erg/cm**3)**('+str(adiabatic_index)+')', 'g/(cm*s)', 'erg/cm**3', 'erg/(g*cm)', 'erg/(g*cm)', 'erg/(g*cm)']
+    outflow_conversions = [mass_to_g * length_to_cm**2 / time_to_s**2, mass_to_g * length_to_cm / time_to_s, mass_to_g * length_to_cm / time_to_s, mass_to_g * length_to_cm / time_to_s,
+                                (mass_to_g * length_to_cm**2 / time_to_s**2)**(1 / adiabatic_index), mass_to_g * length_to_cm**2 / time_to_s,
+                                mass_to_g * length_to_cm**2 / time_to_s**2 ]
+
+    layout = dict(hdf5_fields=np.array(hdf5_fields)[np.argsort(np.array(fields_order))],
+                  leaf_count=leaf_count, total_nodes=total_nodes, xscale=xscale, length_to_cm=length_to_cm,
+                  time_to_s=time_to_s, mass_to_g=mass_to_g, sim_time=sim_time, omega=omega,
+                  adiabatic_index=adiabatic_index, nspecies=nspecies,
+                  atomic_numbers=atomic_numbers, atomic_masses=atomic_masses, Xs=Xs, Zs=Zs,
+                  octo_fields=OCTO_FIELDS + spec_octo_fields, units=units + spec_units,
+                  yt_fields=OCTO_FIELDS + spec_yt_fields, outflow_fields=OUTFLOW_FIELDS + spec_outflow_fields,
+                  outflow_conversions=outflow_conversions + spec_outflow_conversions)
+    layout['data_files'] = get_data_files(filename, f, leaf_count)
+    f.close()
+    field_round = len(hdf5_fields) + 3
+    for i, (data_file, cur_leaf_count) in enumerate(layout['data_files']):
+        if cur_leaf_count is None:
+            f_data = h5py.File(data_file, "r")
+            layout['data_files'][i] = (data_file, int(len(f_data['.silo']) / field_round))
+            f_data.close()
+    try:
+        with open(sidecar, 'w') as fp:
+            json.dump(dict(nspecies=nspecies, stamps=[file_stamp(filename)] + [file_stamp(d[0]) for d in layout['data_files']], layout=layout),
+                      fp, default=lambda o: o.tolist() if hasattr(o, 'tolist') else str(o))
+    except OSError:
+        print('could not write the header cache ' + sidecar)
+    return layout
 def read_headers(filename, nspecies=5):
         import h5py
 
@@ -0,0 +1,250 @@
+#Radial binning engine for the averaging scripts (spherical_averaging_bg.py).
+#Bin indices are computed once, then every column of every binning is scatter-added
+#in a single pass, giving per-bin sums, weights and counts that can be turned into averages.
+import numpy as np
+from numba import njit, prange, get_num_threads
+
+#Bin grid of the averages: logspace(0, log10(rmax)) or linspace(0, rmax)
+def make_bins(rmax, resolution, log = True):
+    if log:
+        return np.logspace(0,np.log10(rmax),resolution)
+    return np.linspace(0,rmax,resolution)
+
+@njit(cache=True)
+def _bin_of(x, top, dr, log, offset, nbins, shift):
+    if log:
+        r = np.log10(x+offset)
+    else:
+        r = x
+    n = -1
+    if r <= top:
+        n = int(r/dr+shift)
+        if n >= nbins or n < 0:
+            n = -1
+    return n
+
+@njit(parallel=True, cache=True)
+def _bin_index(x, top, dr, log, offset, nbins, shift):
+    index = np.empty(x.shape[0], dtype=np.int64)
+    for i in prange(x.shape[0]):
+        index[i] = _bin_of(x[i], top, dr, log, offset, nbins, shift)
+    return index
+
+#Top of the bins and bin width, in log10(x+offset) for log bins
+def _bin_params(bins, log):
+    if log:
+        return np.log10(bins[-1]), np.log10(bins[1]) - np.log10(bins[0])
+    return bins[-1], bins[1] - bins[0]
+
+#Bin of every value, int(x/dr+shift), -1 if it falls outside the bins (log bins are in log10(x+offset);
+#the defaults are the rule of super_average, shift = 0.5 puts linear bins around the bin values)
+def bin_index(x, bins, log = True, offset = 1.0, shift = 1.0):
+    top, dr = _bin_params(bins, log)
+    return _bin_index(np.asarray(x, dtype=np.float64), top, dr, log, offset, len(bins), shift)
+
+@njit(cache=True)
+def _accumulate_range(index, block, columns, weighted, weight_col, start, stop, sums, weights, counts):
+    for i in range(start, stop):
+        for s in range(index.shape[0]):
+            n = index[s,i]
+            if n < 0:
+                continue
+            w = block[weight_col[s]][i]
+            weights[s,n] += w
+            counts[s,n] += 1
+            for k in range(columns.shape[1]):
+                c = columns[s,k]
+                if c < 0:
+                    break
+                if weighted[s,k]:
+                    sums[s,n,k] += block[c][i]*w
+                else:
+                    sums[s,n,k] += block[c][i]
+
+@njit(cache=True)
+def _accumulate(index, block, columns, weighted, weight_col, nbins):
+    sums = np.zeros((index.shape[0], nbins, columns.shape[1]))
+    weights = np.zeros((index.shape[0], nbins))
+    counts = np.zeros((index.shape[0], nbins), dtype=np.int64)
+    _accumulate_range(index, block, columns, weighted, weight_col, 0, index.shape[1], sums, weights, counts)
+    return sums, weights, counts
+
+#Every chunk of cells gets private bins, reduced in chunk order afterwards (deterministic for a given nchunks)
+@njit(parallel=True, cache=True)
+def _accumulate_parallel(index, block, columns, weighted, weight_col, nbins, nchunks):
+    ncell = index.shape[1]
+    part_sums = np.zeros((nchunks, index.shape[0], nbins, columns.shape[1]))
+    part_weights = np.zeros((nchunks, index.shape[0], nbins))
+    part_counts = np.zeros((nchunks, index.shape[0], nbins), dtype=np.int64)
+    for c in prange(nchunks):
+        _accumulate_range(index, block, columns, weighted, weight_col, c*ncell//nchunks, (c+1)*ncell//nchunks,
+                          part_sums[c], part_weights[c], part_counts[c])
+    sums = part_sums[0].copy()
+    weights = part_weights[0].copy()
+    counts = part_counts[0].copy()
+    for c in range(1, nchunks):
+        sums += part_sums[c]
+        weights += part_weights[c]
+        counts += part_counts[c]
+    return sums, weights, counts
+
+#Scatter-add the columns of block (a tuple of contiguous float64 arrays, read in place) into the bins
+#of several binnings at once. Binning s has the bin of every cell in index[s], adds the block columns
+#columns[s] (padded with -1), multiplying those flagged in weighted[s] by the weight column weight_col[s]. Returns sums
+#(binning x nbins x column), summed weights and cell counts per bin. parallel splits the cells
+#over the numba threads (NUMBA_NUM_THREADS), which matches the serial sums to rounding.
+def accumulate(index, block, columns, weighted, weight_col, nbins, parallel = False):
+    if parallel:
+        return _accumulate_parallel(index, block, columns, weighted, weight_col, nbins, get_num_threads())
+    return _accumulate(index, block, columns, weighted, weight_col, nbins)
+
+#Fills several binnings in one scan of the cells. Every spec is a dict with bin_by, keys, weighted_keys,
+#weight, resolution, rmax and log (as make_average), optionally offset and shift (see bin_index);
+#returns (bins, sums, weights, counts) for each, sums having one column per spec['keys'].
+#timings, if given, is a dict that gets the seconds spent on the bin indices and on the accumulation.
+def bin_many(data, specs, parallel = False, timings = None):
+    import time
+    t0 = time.time()
+    names = []
+    for spec in specs:
+        for key in spec['keys'] + [spec['weight']]:
+            if key not in names:
+                names.append(key)
+    ncol = max([len(spec['keys']) for spec in specs])
+    nbins = max([spec['resolution'] for spec in specs])
+    columns = np.full((len(specs), ncol), -1, dtype=np.int64)
+    weighted = np.zeros((len(specs), ncol), dtype=np.bool_)
+    weight_col = np.zeros(len(specs), dtype=np.int64)
+    index = np.empty((len(specs), len(data[specs[0]['bin_by']])), dtype=np.int32)
+    all_bins = []
+    for s, spec in enumerate(specs):
+        for k, key in enumerate(spec['keys']):
+            columns[s,k] = names.index(key)
+            weighted[s,k] = key in spec['weighted_keys']
+        weight_col[s] = names.index(spec['weight'])
+        all_bins.append(make_bins(spec['rmax'], spec['resolution'], spec['log']))
+        index[s] = bin_index(data[spec['bin_by']], all_bins[s], log = spec['log'], offset = spec.get('offset', 1.0), shift = spec.get('shift', 1.0))
+    t1 = time.time()
+    # no stacked copy: the engine reads the columns of data directly (converted only if not contiguous float64)
+    block = tuple([np.ascontiguousarray(data[key], dtype=np.float64) for key in names])
+    sums, weights, counts = accumulate(index, block, columns, weighted, weight_col, nbins, parallel = parallel)
+    if timings is not None:
+        timings['index'] = timings.get('index', 0) + t1 - t0
+        timings['accumulate'] = timings.get('accumulate', 0) + time.time() - t1
+    results = []
+    for s, spec in enumerate(specs):
+        n = spec['resolution']
+        results.append((all_bins[s], sums[s,:n,:len(spec['keys'])], weights[s,:n], counts[s,:n]))
+    return results
+
+#Weighted columns divided by the bin weight (0 in empty bins), the others left as sums
+def averages(sums, weights, weighted):
+    result = sums.copy()
+    for k in np.where(weighted)[0]:
+        result[:,k] = 0
+        np.divide(sums[:,k], weights, out=result[:,k], where=weights != 0)
+    return result
+
+#bin_many summed over an iterable of chunks of cells (dicts of columns), so only one chunk is held at a time;
+#every spec needs an explicit rmax, the bins have to be the same for all chunks
+def bin_stream(chunks, specs, parallel = False):
+    total = None
+    for data in chunks:
+        results = bin_many(data, specs, parallel = parallel)
+        if total is None:
+            total = [list(result) for result in results]
+            continue
+        for s in range(len(specs)):
+            for k in range(1, 4):
+                total[s][k] = total[s][k] + results[s][k]
+    if total is None:
+        # no chunks at all (e.g. an empty region): empty bins
+        return [(make_bins(spec['rmax'], spec['resolution'], spec['log']), np.zeros((spec['resolution'], len(spec['keys']))),
+                 np.zeros(spec['resolution']), np.zeros(spec['resolution'], dtype=np.int64)) for spec in specs]
+    return [tuple(result) for result in total]
+
+#Prefix sums of a column as an unevaluated sum hi + lo (compensated), so that differences of two
+#prefixes, i.e. the sum over a range of cells, keep full precision even far out in the profile
+@njit(cache=True)
+def _prefix(values):
+    hi = np.zeros(values.shape[0]+1)
+    lo = np.zeros(values.shape[0]+1)
+    s = 0.0
+    c = 0.0
+    for i in range(values.shape[0]):
+        t = s + values[i]
+        bp = t - s
+        c += (s - (t - bp)) + (values[i] - bp)
+        s = t
+        hi[i+1] = s
+        lo[i+1] = c
+    return hi, lo
+
+#Bin of x for the binary search: cells outside the bins go to -1 below the first bin and to nbins
+#above the last, so the key stays monotonic in x
+@njit(cache=True)
+def _sort_key(x, top, dr, log, offset, nbins, shift):
+    k = _bin_of(x, top, dr, log, offset, nbins, shift)
+    if k >= 0:
+        return k
+    if log:
+        if x+offset <= 0:
+            return -1
+        r = np.log10(x+offset)
+    else:
+        r = x
+    if r <= top and r/dr+shift < 0:
+        return -1
+    return nbins
+
+#First sorted cell of every bin and the end of the last one (bins are monotonic in x)
+@njit(cache=True)
+def _bin_starts(xs, top, dr, log, offset, nbins, shift):
+    pos = np.empty(nbins+1, dtype=np.int64)
+    for n in range(nbins+1):
+        lo = 0
+        hi = xs.shape[0]
+        while lo < hi:
+            mid = (lo+hi)//2
+            k = _sort_key(xs[mid], top, dr, log, offset, nbins, shift)
+            if k < n:
+                lo = mid+1
+            else:
+                hi = mid
+        pos[n] = lo
+    return pos
+
+#Cells sorted by the bin_by column once, with prefix sums of keys (times the weight column for
+#weighted_keys) and of the weight; rebin() then answers any binning of it in O(bins log N).
+#Needs two float64 arrays per column on top of the data.
+def sorted_index(data, bin_by, keys, weighted_keys, weight = 'dV'):
+    order = np.argsort(data[bin_by], kind='stable')
+    index = dict(bin_by = bin_by, weighted_keys = list(weighted_keys), weight = weight, order = order,
+                 x = np.ascontiguousarray(np.asarray(data[bin_by], dtype=np.float64)[order]), prefix = {})
+    index['weights'] = _prefix(np.ascontiguousarray(np.asarray(data[weight], dtype=np.float64)[order]))
+    update_index(index, data, keys)
+    return index
+
+#(Re)builds the prefix sums of keys, e.g. after a column of data was changed
+def update_index(index, data, keys):
+    w = np.asarray(data[index['weight']], dtype=np.float64)[index['order']]
+    for key in keys:
+        values = np.asarray(data[key], dtype=np.float64)[index['order']]
+        if key in index['weighted_keys']:
+            values = values*w
+        index['prefix'][key] = _prefix(np.ascontiguousarray(values))
+
+def _range_sums(prefix, pos):
+    hi, lo = prefix
+    return (hi[pos[1:]] - hi[pos[:-1]]) + (lo[pos[1:]] - lo[pos[:-1]])
+
+#Same (bins, sums, weights, counts) as bin_many for the indexed columns keys, without a pass over the cells
+#(offset and shift as in bin_index)
+def rebin(index, keys, rmax, resolution, log = True, offset = 1.0, shift = 1.0):
+    bins = make_bins(rmax, resolution, log)
+    top, dr = _bin_params(bins, log)
+    pos = _bin_starts(index['x'], top, dr, log, offset, len(bins), shift)
+    sums = np.zeros((len(bins), len(keys)))
+    for k, key in enumerate(keys):
+        sums[:,k] = _range_sums(index['prefix'][key], pos)
+    return bins, sums, _range_sums(index['weights'], pos), np.diff(pos)
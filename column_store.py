@@ -0,0 +1,84 @@
+#Columnar binary store of an ASCII table: one raw float64 file per column (memory-mappable)
+#and a meta.json with the column names, row count and the size/mtime and sha1 of the source.
+#A store is reused as long as the source is unchanged, so the text is only parsed once.
+import numpy as np
+import json
+import os
+
+def file_stamp(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+def file_checksum(path, blocksize = 2**24):
+    import hashlib
+    sha = hashlib.sha1()
+    with open(path, 'rb') as fp:
+        block = fp.read(blocksize)
+        while block:
+            sha.update(block)
+            block = fp.read(blocksize)
+    return sha.hexdigest()
+
+def read_meta(store):
+    with open(store + '/meta.json') as fp:
+        return json.load(fp)
+
+#Written to a temporary file and moved into place, so meta.json is never seen half written
+def write_meta(store, meta):
+    tmp = store + '/meta.json.' + str(os.getpid()) + '.tmp'
+    with open(tmp, 'w') as fp:
+        json.dump(meta, fp)
+    os.replace(tmp, store + '/meta.json')
+
+#True if store holds the columns of source. The size/mtime is checked first; if only that changed
+#(copied or touched file) the checksum decides, and the stamp is refreshed when it still matches.
+def store_up_to_date(source, store, columns = None):
+    if not os.path.exists(store + '/meta.json'):
+        return False
+    meta = read_meta(store)
+    if columns is not None and list(columns) != meta['columns']:
+        return False
+    if meta['stamp'] == file_stamp(source):
+        return True
+    if meta['checksum'] != file_checksum(source):
+        return False
+    meta['stamp'] = file_stamp(source)
+    write_meta(store, meta)
+    return True
+
+#Parses source in chunks of chunksize rows (pandas) and appends every column to store/<column>.f8
+def ascii_to_columns(source, store, columns, usecols = None, sep = ' ', chunksize = 10**6):
+    import pandas as pd
+    print('Converting '+source+' to the column store '+store)
+    if not os.path.isdir(store):
+        os.makedirs(store)
+    if usecols is None:
+        usecols = list(range(len(columns)))
+    if os.path.exists(store + '/meta.json'):
+        os.remove(store + '/meta.json')
+    files = [open(store + '/' + key + '.f8', 'wb') for key in columns]
+    rows = 0
+    for chunk in pd.read_csv(source, sep=sep, usecols=usecols, header=None, chunksize=chunksize):
+        for fp, col in zip(files, usecols):
+            np.ascontiguousarray(chunk[col], dtype=np.float64).tofile(fp)
+        rows += len(chunk)
+    for fp in files:
+        fp.close()
+    meta = dict(columns=list(columns), rows=rows, stamp=file_stamp(source), checksum=file_checksum(source))
+    write_meta(store, meta)
+
+#Read-only memory maps of every column of a store
+def load_columns(store):
+    meta = read_meta(store)
+    data = {}
+    for key in meta['columns']:
+        data[key] = np.memmap(store + '/' + key + '.f8', dtype=np.float64, mode='r', shape=(meta['rows'],))
+    return data
+
+#Columns of an ASCII table, from its store (default source.cols) which is (re)built when out of date
+def cached_columns(source, columns, store = None, usecols = None, sep = ' '):
+    if store is None:
+        store = source + '.cols'
+    if not store_up_to_date(source, store, columns):
+        ascii_to_columns(source, store, columns, usecols = usecols, sep = sep)
+    return load_columns(store)
@@ -0,0 +1,126 @@
+#Cached Helmholtz EoS inversion (helmholtz.helmeos_DE) for the averaged profiles of the averaging scripts.
+#Results are kept in an npz file keyed on the exact (dens, ener, abar, zbar) inputs, so a rerun on the same
+#averages does not call the EoS at all. New inputs start from the temperature of the nearest cached point in
+#(log rho, log e), e.g. the neighbouring bins of a previous snapshot, instead of a fixed guess. Optionally a
+#table on a (log rho, log T) grid (make_table) gives approximate values by interpolation, without the EoS.
+import numpy as np
+import helmholtz
+import os
+from types import SimpleNamespace
+
+FIELDS = ['temp', 'ptot', 'stot', 'etot']
+INPUTS = ['dens', 'ener', 'abar', 'zbar']
+
+def load_cache(path):
+    if path is not None and os.path.exists(path):
+        with np.load(path) as f:
+            return {key: f[key] for key in INPUTS + FIELDS}
+    return {key: np.zeros(0) for key in INPUTS + FIELDS}
+
+#Adds the new rows to whatever is on disk by now. Processes sharing the file (the sweep_M workers) take
+#an exclusive lock on path.lock for the load-merge-write, so none of their rows are lost; the file is
+#replaced atomically, so readers never need the lock.
+def save_cache(path, new):
+    import fcntl
+    with open(path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        cache = load_cache(path)
+        known = set(_keys(cache))
+        keep = np.array([key not in known for key in _keys(new)], dtype=bool)
+        for key in INPUTS + FIELDS:
+            cache[key] = np.concatenate((cache[key], new[key][keep]))
+        tmp = path + '.' + str(os.getpid()) + '.tmp.npz'
+        np.savez(tmp, **cache)
+        os.replace(tmp, path)
+
+def _keys(rows):
+    block = np.ascontiguousarray(np.vstack([rows[key] for key in INPUTS]).T, dtype=np.float64)
+    return [row.tobytes() for row in block]
+
+#Temperature of the nearest cached point with the same abar, zbar in (log rho, log e), tguess where there is none
+def warm_guess(cache, dens, ener, abar, zbar, tguess = 1e7):
+    from scipy.spatial import cKDTree
+    guess = np.broadcast_to(np.asarray(tguess, dtype=np.float64), dens.shape).copy()
+    for a, z in set(zip(abar, zbar)):
+        rows = (cache['abar'] == a) & (cache['zbar'] == z) & (cache['dens'] > 0) & (cache['ener'] > 0)
+        mine = (abar == a) & (zbar == z) & (dens > 0) & (ener > 0)
+        if not rows.any() or not mine.any():
+            continue
+        tree = cKDTree(np.vstack((np.log10(cache['dens'][rows]), np.log10(cache['ener'][rows]))).T)
+        nearest = tree.query(np.vstack((np.log10(dens[mine]), np.log10(ener[mine]))).T)[1]
+        guess[mine] = cache['temp'][rows][nearest]
+    return guess
+
+#Forward EoS (helmholtz.helmeos) on a log10 rho x log10 T grid for one composition, saved to path if given.
+#The EoS fields are stored as log10, every row of log10 etot has to increase with T.
+def make_table(abar, zbar, logrho, logT, path = None):
+    lr, lt = np.meshgrid(logrho, logT, indexing='ij')
+    h = helmholtz.helmeos(dens = 10**lr.ravel(), temp = 10**lt.ravel(), abar = abar, zbar = zbar)
+    table = dict(abar = abar, zbar = zbar, logrho = np.asarray(logrho, dtype=np.float64))
+    for key in FIELDS:
+        table[key] = np.log10(np.asarray(getattr(h, key))).reshape(lr.shape)
+    if path is not None:
+        np.savez(path, **table)
+    return table
+
+def load_table(path):
+    with np.load(path) as f:
+        return {key: f[key] for key in f.files}
+
+#Approximate EoS fields of (dens, ener) from a table: log10 of every field is interpolated against log10 etot
+#along the two bracketing density rows, then linearly in log10 rho. Returns the fields and the mask of the
+#points inside the table (the others are left 0).
+def table_eval(table, dens, ener, abar, zbar):
+    fields = {key: np.zeros(dens.shape) for key in FIELDS}
+    logrho = table['logrho']
+    inside = (abar == table['abar']) & (zbar == table['zbar']) & (dens > 0) & (ener > 0)
+    lr = np.log10(np.where(inside, dens, 1.0))
+    le = np.log10(np.where(inside, ener, 1.0))
+    inside &= (lr >= logrho[0]) & (lr <= logrho[-1])
+    i = np.clip(np.searchsorted(logrho, lr) - 1, 0, len(logrho) - 2)
+    w = (lr - logrho[i]) / (logrho[i+1] - logrho[i])
+    for row, weight in [(i, 1 - w), (i + 1, w)]:
+        for n in np.unique(row[inside]):
+            sel = inside & (row == n)
+            etot = table['etot'][n]
+            inside[sel] &= (le[sel] >= etot[0]) & (le[sel] <= etot[-1])
+            for key in FIELDS:
+                fields[key][sel] += weight[sel] * np.interp(le[sel], etot, table[key][n])
+    for key in FIELDS:
+        fields[key] = np.where(inside, 10**fields[key], 0.0)
+    return fields, inside
+
+#Drop-in for helmholtz.helmeos_DE returning temp, ptot, stot and etot. Inputs found in the cache file are
+#not solved again, table (an npz path from make_table or its dict) answers the others where it covers them,
+#and the rest is solved from warm-started guesses and added to the cache (cache = None disables it).
+def helmeos_DE(dens, ener, abar, zbar, tguess = 1e7, cache = 'helm_cache.npz', table = None):
+    shape = np.broadcast(dens, ener, abar, zbar).shape
+    dens, ener, abar, zbar = [np.array(x, dtype=np.float64).ravel() for x in np.broadcast_arrays(dens, ener, abar, zbar)]
+    stored = load_cache(cache)
+    fields = {key: np.zeros(dens.shape) for key in FIELDS}
+    lookup = {key: n for n, key in enumerate(_keys(stored))}
+    rows = np.array([lookup.get(key, -1) for key in _keys(dict(dens = dens, ener = ener, abar = abar, zbar = zbar))], dtype=np.int64)
+    todo = rows < 0
+    for key in FIELDS:
+        fields[key][~todo] = stored[key][rows[~todo]]
+    ntable = 0
+    if table is not None and todo.any():
+        if isinstance(table, str):
+            table = load_table(table)
+        approx, inside = table_eval(table, dens[todo], ener[todo], abar[todo], zbar[todo])
+        where = np.where(todo)[0][inside]
+        for key in FIELDS:
+            fields[key][where] = approx[key][inside]
+        todo[where] = False
+        ntable = len(where)
+    print('EoS:', int(np.sum(rows >= 0)), 'cached,', ntable, 'from the table,', int(np.sum(todo)), 'solved')
+    if todo.any():
+        new = dict(dens = dens[todo], ener = ener[todo], abar = abar[todo], zbar = zbar[todo])
+        guess = warm_guess(stored, new['dens'], new['ener'], new['abar'], new['zbar'], tguess)
+        h = helmholtz.helmeos_DE(dens = new['dens'], ener = new['ener'], abar = new['abar'], zbar = new['zbar'], tguess = guess)
+        for key in FIELDS:
+            new[key] = np.asarray(getattr(h, key), dtype=np.float64).ravel()
+            fields[key][todo] = new[key]
+        if cache is not None:
+            save_cache(cache, new)
+    return SimpleNamespace(**{key: fields[key].reshape(shape) for key in FIELDS})
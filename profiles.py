@@ -0,0 +1,26 @@
+#Radial profile integrals of the averaged (binned) quantities, shared by the averaging scripts.
+#Everything is a cumulative sum or cumulative trapezoid, O(n) in the number of bins.
+import numpy as np
+
+#Mass enclosed by (and including) every shell
+def enclosed_mass(dm):
+    return np.cumsum(dm)
+
+#q coordinate: mass fraction exterior to every shell
+def mass_coordinate(dm):
+    return 1-(np.cumsum(dm)/np.sum(dm))
+
+#Trapezoid integral of y from every r[i] out to r[-1], i.e. np.trapz(y[i:],r[i:]) for all i
+def exterior_integral(r, y):
+    seg = 0.5*(y[1:]+y[:-1])*np.diff(r)
+    result = np.zeros(len(r))
+    result[:-1] = np.cumsum(seg[::-1])[::-1]
+    return result
+
+#Gravitational potential of spherical shells: interior mass plus the shells outside r
+def gravitational_potential(r, mr, rho, G = 6.67e-8):
+    return -G*mr/r-4*np.pi*G*exterior_integral(r, r*rho)
+
+#Radius of the outermost sign change of the total energy (where material becomes unbound)
+def bound_radius(r, etot):
+    return r[np.where(np.diff(np.sign(etot)))[0][-1]]
@@ -6,17 +6,27 @@ Created on Mon May 17 10:54:27 2021
 @author: bradmunson
 """
 import Octo2Yt as ot
+import octo_kernels as ok
 import numpy as np
 import matplotlib.pyplot as plt
-from numba import njit
+import binning
+import profiles
 import rcbtools as r
-import helmholtz
+import eos_cache
 
 #USER PARAMETERS
-filename = 'X.5100.silo.yt.npz' #Name of Octo-Tiger AMR file (compressed or not)
+filename = 'X.5100.silo.yt.npz' #Name of Octo-Tiger AMR file (compressed, .ytc cache directory or not)
 rmax = -1
 resolution = 1000
 read_data = True
+nprocs = 1 #Number of processes used to read the Silo sub-files
+use_yt = False #Build a yt dataset first (False reads a flat cell table directly, without yt)
+parallel = True #Bin the averages on all numba threads (set NUMBA_NUM_THREADS to limit them)
+stream = False #Average chunk by chunk from the Silo file or cache, memory bounded by chunk_cells (no yt)
+chunk_cells = 2**22 #Cells per chunk when streaming
+use_index = False #Sort the cells by r and R once and re-bin from prefix sums (fast rmax/resolution changes, more memory)
+eos_cache_file = 'helm_cache.npz' #EoS results kept between runs (None to always solve)
+eos_table = None #npz table from eos_cache.make_table for approximate EoS values (None solves exactly)
 
 G = 6.67e-8
 Msun = 1.99e33
@@ -34,41 +44,27 @@ AU2cm = 1.496e+13
 A = np.pi * m_e**4 * c**5 / (3*h**3) #Energy/Volume
 B = 8 * np.pi * m_p * mu_e * (m_e * c / h)**3 / 3
 
-if read_data:
-    print('Reading Data...')
-    
-    #Read in file data
-    if 'yt.npz' in filename:
-        ds = ot.loadFromNPZ(filename) #Filename if compressed
-    else:
-        ds = ot.octo2yt_amr(filename, nspecies=5, gather_outflows=False, savefile=True, copy_path='./') #Filename if not compressed
-    
-    print('Done reading, processing data...')
-    
-    #Format data to numpy-like structure
-    data = ds.all_data() 
-    mtot = np.sum(data['stream','density']*data['index','cell_volume']*ds.length_unit**3)
-    print('Total mass: ',mtot)
-    
-    #Compute relavent data and store in dictionary of numpy arrays
+#Compute relavent data of a set of cells and store in dictionary of numpy arrays, relative to
+#the position and velocity of the center (densest cell); j is zeroed beyond rmax_j if given
+def cell_columns(cells, center, rmax_j = -1):
     d = {}
-    i_center = np.argmax(data['stream','density'])
-    d['x'] = np.array((data['index','x'] - data['index','x'][i_center])*ds.length_unit)
-    d['y'] = np.array((data['index','y'] - data['index','y'][i_center])*ds.length_unit)
-    d['z'] = np.array((data['index','z'] - data['index','z'][i_center])*ds.length_unit)
-    d['dV'] =  np.array(data['index','cell_volume']*ds.length_unit**3)
+    d['x'] = cells['x'] - center['x']
+    d['y'] = cells['y'] - center['y']
+    d['z'] = cells['z'] - center['z']
+    d['dV'] = np.array(cells['cell_volume'])
     d['r'] = np.sqrt(d['x']**2+d['y']**2+d['z']**2)
     d['R'] = np.sqrt(d['x']**2+d['y']**2)
-    d['tau'] = np.array(data['stream','tau'])
-    d['rho'] = np.array(data['stream','density'])
-    d['sx'] = np.array(data['stream','sx']/d['rho'] - data['stream','sx'][i_center]/d['rho'][i_center])*d['rho']
-    d['sy'] = np.array(data['stream','sy']/d['rho'] - data['stream','sy'][i_center]/d['rho'][i_center])*d['rho']
-    d['sz'] = np.array(data['stream','sz']/d['rho'] - data['stream','sz'][i_center]/d['rho'][i_center])*d['rho']
+    d['tau'] = np.array(cells['tau'])
+    d['rho'] = np.array(cells['density'])
+    d['sx'] = (cells['sx']/d['rho'] - center['vx'])*d['rho']
+    d['sy'] = (cells['sy']/d['rho'] - center['vy'])*d['rho']
+    d['sz'] = (cells['sz']/d['rho'] - center['vz'])*d['rho']
     d['j'] = (d['x']*(d['sy'])-d['y']*(d['sx']))/d['rho']
-    d['ek'] = 0.5*np.array(d['sx']**2+d['sy']**2+d['sz']**2)/d['rho'] #Energy/Volume
+    if rmax_j > 0: d['j'][d['r'] > rmax_j] = 0 #Ensures we don't count j for cells above and below the star
+    d['ek'] = 0.5*(d['sx']**2+d['sy']**2+d['sz']**2)/d['rho'] #Energy/Volume
     d['dm'] = d['rho']*d['dV']
-    d['etot'] = np.array(data['gas','etot'] + data['gas','gpot']) #total energy (including binding)
-    d['egas'] = np.array(data['stream','egas'])
+    if 'etot' in cells: d['etot'] = cells['etot'] #total energy (including binding)
+    d['egas'] = np.array(cells['egas'])
     d['edeg'] = A*(8*(d['rho']/B)**3*(((d['rho']/B)**2+1)**0.5-1)-\
                    ((d['rho']/B)*(2*(d['rho']/B)**2-3)*((d['rho']/B)**2+1)**0.5)+3*np.arcsinh(d['rho']/B))
     d['eint'] = np.zeros(np.shape(d['x']))
@@ -76,87 +72,130 @@ if read_data:
     d['eint'][idxs] = d['egas'][idxs] - d['ek'][idxs] - d['edeg'][idxs]
     idxs = np.where(d['eint'] == 0)
     d['eint'][idxs] = d['tau'][idxs]**(5/3)
-    d['primary_core'] = np.array((data['stream','rho_1'])/data['stream','density'])
-    d['primary_envelope'] = np.array((data['stream','rho_2'])/data['stream','density'])
-    d['secondary'] = np.array((data['stream','rho_3']+data['stream','rho_4'])/data['stream','density'])
-                     
+    d['primary_core'] = cells['rho_1']/cells['density']
+    d['primary_envelope'] = cells['rho_2']/cells['density']
+    d['secondary'] = (cells['rho_3']+cells['rho_4'])/cells['density']
+    return d
 
+def find_center(cells):
+    i_center = np.argmax(cells['density'])
+    return dict(x = cells['x'][i_center], y = cells['y'][i_center], z = cells['z'][i_center], rho = cells['density'][i_center],
+                vx = cells['sx'][i_center]/cells['density'][i_center], vy = cells['sy'][i_center]/cells['density'][i_center],
+                vz = cells['sz'][i_center]/cells['density'][i_center])
 
-print('Spherical Averaging')
+cell_fields = ['density','tau','sx','sy','sz','egas','pot','rho_1','rho_2','rho_3','rho_4']
 
-#Serialized averaging function (WAY faster)
-@njit
-def super_average(arr, weight_these, bins, weight_index = 1, log = True):
-    rs = arr[:,0]
-    weights = arr[:,weight_index]
-    rr = bins
-    if log:
-        logrmax = np.log10(rr[-1])
-        dr = np.log10(rr[1]) - np.log10(rr[0])
-    else:
-        logrmax = rr[-1]
-        dr = rr[1] - rr[0]
-    num = np.shape(arr)[1]
-    
-    result = np.zeros((len(bins),num))
-    result[:,0] = rr
-    if log:
-        for i,r in enumerate(np.log10(rs+1)):
-            for j in range(1,num):
-                if r <= logrmax:
-                    n = int(r/dr+1)
-                    if j in weight_these:
-                        result[n,j] += arr[i,j]*weights[i]
-                    else:
-                        result[n,j] += arr[i,j]
-    else:
-        for i,r in enumerate(rs):
-            for j in range(1,num):
-                if r <= logrmax:
-                    n = int(r/dr+1)
-                    if j in weight_these:
-                        result[n,j] += arr[i,j]*weights[i]
-                    else:
-                        result[n,j] += arr[i,j]
-
-    for j in weight_these:
-        result[:,j] = result[:,j] / result[:,weight_index]
+if read_data and not stream:
+    print('Reading Data...')
     
-    return result
-
-#A more user friendly function that uses the serialized version
-def make_average(data, keys, weighted_keys, bin_by, resolution = 1000, ave = {}, weight = 'dV', rmax = -1, log = True):
-    i_weight = keys.index(weight)
-    if rmax < 0: rmax = np.max(d[bin_by]/np.sqrt(3))
-    if log:
-        bins = np.logspace(0,np.log10(rmax),resolution)
+    #Read in file data
+    if use_yt:
+        if 'yt.npz' in filename or filename.endswith('.ytc'):
+            ds = ot.loadFromNPZ(filename) #Filename if compressed or a column cache
+        else:
+            ds = ot.octo2yt_amr(filename, nspecies=5, gather_outflows=False, savefile=True, copy_path='./', nprocs=nprocs, cache_format='columns') #Filename if not compressed
+        
+        print('Done reading, processing data...')
+        
+        #Format data to numpy-like structure
+        data = ds.all_data() 
+        cells = {}
+        for ax in ['x','y','z']:
+            cells[ax] = np.array(data['index',ax]*ds.length_unit)
+        cells['cell_volume'] = np.array(data['index','cell_volume']*ds.length_unit**3)
+        for key in ['density','tau','sx','sy','sz','egas','rho_1','rho_2','rho_3','rho_4']:
+            cells[key] = np.array(data['stream',key])
+        cells['etot'] = np.array(data['gas','etot'] + data['gas','gpot'])
     else:
-        bins = np.linspace(0,rmax,resolution)
-    weight_these = [keys.index(this_one) for this_one in weighted_keys]
+        #Flat cell table straight from the Silo file or the .ytc cache, no yt needed
+        cells = ot.load_cell_table(filename, nspecies=5, fields=cell_fields)
+        print('Done reading, processing data...')
+        cells['etot'] = ok.specific_total_energy(cells['egas'], cells['sx'], cells['sy'], cells['sz'], cells['density'], cells['tau'], 5/3, eps_1)
+        cells['etot'] += cells['pot']/cells['density']
+    mtot = np.sum(cells['density']*cells['cell_volume'])
+    print('Total mass: ',mtot)
     
-    arr = np.vstack([data[key] for key in keys]).T
-    result = super_average(arr, weight_these, bins, weight_index = i_weight, log = log)
-    result = np.delete(result,np.where(result[:,1] == 0)[0],axis=0)
+    d = cell_columns(cells, find_center(cells))
+    del cells
+
+if stream:
+    #Out-of-core: the cells are read chunk by chunk for every pass, only one chunk and the bins are in memory
+    print('Streaming data in chunks of', chunk_cells, 'cells...')
+    mtot = 0
+    center = dict(rho = -1)
+    lo = np.full(3, np.inf)
+    hi = np.full(3, -np.inf)
+    for cells in ot.iter_cell_table(filename, nspecies=5, fields=['density','sx','sy','sz'], chunk_cells=chunk_cells):
+        mtot += np.sum(cells['density']*cells['cell_volume'])
+        chunk_center = find_center(cells)
+        if chunk_center['rho'] > center['rho']: center = chunk_center
+        lo = np.minimum(lo, [np.min(cells[ax]) for ax in ['x','y','z']])
+        hi = np.maximum(hi, [np.max(cells[ax]) for ax in ['x','y','z']])
+    print('Total mass: ',mtot)
+    c = np.array([center['x'], center['y'], center['z']])
+    r_extent = np.sqrt(np.sum(np.maximum(c - lo, hi - c)**2)) #Farthest cell center (a corner of the box)
     
+    def stream_columns(rmax_j = -1):
+        for cells in ot.iter_cell_table(filename, nspecies=5, fields=cell_fields, chunk_cells=chunk_cells):
+            yield cell_columns(cells, center, rmax_j)
+                     
+
+
+print('Spherical Averaging')
+
+#Averages on radial bins, using the single pass binning engine in binning.py
+def make_average(data, keys, weighted_keys, bin_by, resolution = 1000, ave = {}, weight = 'dV', rmax = -1, log = True, parallel = parallel, index = None):
+    make_averages(data, [dict(keys=keys, weighted_keys=weighted_keys, bin_by=bin_by, resolution=resolution, ave=ave, weight=weight, rmax=rmax, log=log, index=index)], parallel = parallel)
+
+#Several make_average calls (dicts of its arguments) filled in a single scan of the cells;
+#data is a dict of columns or a function returning an iterator over chunks of them
+def make_averages(data, specs, parallel = parallel):
+    specs = [dict(dict(resolution = 1000, weight = 'dV', rmax = -1, log = True), **spec) for spec in specs]
+    for spec in specs:
+        if spec['rmax'] < 0 and spec.get('index') is not None: spec['rmax'] = spec['index']['x'][-1]/np.sqrt(3)
+        if spec['rmax'] < 0: spec['rmax'] = np.max(data[spec['bin_by']]/np.sqrt(3))
+    #specs with a binning.sorted_index are answered from its prefix sums, the rest in one scan of the cells
+    scan = [spec for spec in specs if spec.get('index') is None]
+    if len(scan) == 0:
+        scanned = []
+    elif callable(data):
+        scanned = binning.bin_stream(data(), scan, parallel = parallel) #streamed chunks, rmax has to be given
+    else:
+        scanned = binning.bin_many(data, scan, parallel = parallel)
+    results = []
+    for spec in specs:
+        if spec.get('index') is None:
+            results.append(scanned.pop(0))
+        else:
+            index = spec['index']
+            if spec['weight'] != index['weight'] or [key in spec['weighted_keys'] for key in spec['keys']] != [key in index['weighted_keys'] for key in spec['keys']]:
+                raise ValueError('the sorted index of '+spec['bin_by']+' was built with different weights')
+            results.append(binning.rebin(index, spec['keys'], spec['rmax'], spec['resolution'], spec['log'],
+                                         offset = spec.get('offset', 1.0), shift = spec.get('shift', 1.0)))
     
-    for i,key in enumerate(keys):
-        ave[key] = result.T[i]
+    for spec, (bins, sums, weights, counts) in zip(specs, results):
+        weighted = np.array([key in spec['weighted_keys'] for key in spec['keys']])
+        result = binning.averages(sums, weights, weighted)
+        result[:,0] = bins
+        result = np.delete(result,np.where(result[:,1] == 0)[0],axis=0)
+        
+        for i,key in enumerate(spec['keys']):
+            spec['ave'][key] = result.T[i]
 
 #Find max radius defined by the average radius at which material is bound
-def find_rmax(data):
+def find_rmax(data, rmax = -1, index = None):
     temp = {}
-    make_average(data, ['r','dV','dm','ek','eint'], ['ek','eint'], bin_by = 'r', ave = temp, weight = 'dV')
+    make_average(data, ['r','dV','dm','ek','eint'], ['ek','eint'], bin_by = 'r', ave = temp, weight = 'dV', rmax = rmax, index = index)
     
     temp['rho'] = temp['dm'] / temp['dV']
-    temp['mr'] = np.array([sum(temp['dm'][:i+1]) for i in range(len(temp['dm']))])
+    temp['mr'] = profiles.enclosed_mass(temp['dm'])
     temp['r'] = ((3/4) * np.cumsum(temp['dV']) / np.pi)**(1/3)
     
-    uint = np.array([np.trapz(temp['r'][i:]*temp['rho'][i:],temp['r'][i:]) for i in range(len(temp['r']))])
-    temp['u'] = -G*temp['mr']/temp['r']-4*np.pi*G*uint
+    temp['u'] = profiles.gravitational_potential(temp['r'], temp['mr'], temp['rho'], G)
     
     temp['etot'] = temp['ek']+temp['u']*temp['rho']+temp['eint']
     
-    rmax = temp['r'][np.where(np.diff(np.sign(temp['etot'])))[0][-1]]
+    rmax = profiles.bound_radius(temp['r'], temp['etot'])
     
     return rmax
 
@@ -164,19 +203,34 @@ def find_rmax(data):
 #Initialize dictionaries to store spherically or cylindrically averaged data
 ave = {}
 ave_cyl = {}
-rmax = find_rmax(d) 
-d['j'][d['r'] > rmax] = 0 #Ensures we don't count j for cells above and below the star
-make_average(d, ['r','dV','dm','tau','ek','eint','egas','edeg','j','secondary', 'primary_envelope', 'primary_core'],['tau','ek','eint','egas','edeg','j','secondary', 'primary_envelope', 'primary_core'],\
-             bin_by = 'r', ave = ave, rmax = rmax)
-make_average(d, ['R','dV','dm','j'], ['j'], bin_by = 'R', ave = ave_cyl, resolution = 130, rmax=rmax,\
-             weight = 'dm', log = True)
+r_index = None
+R_index = None
+keys_r = ['r','dV','dm','tau','ek','eint','egas','edeg','j','secondary', 'primary_envelope', 'primary_core']
+weighted_r = ['tau','ek','eint','egas','edeg','j','secondary', 'primary_envelope', 'primary_core']
+if stream:
+    rmax = find_rmax(stream_columns, rmax = r_extent/np.sqrt(3))
+    data = lambda: stream_columns(rmax) #j is zeroed above and below the star while streaming
+else:
+    if use_index:
+        #Prefix sums of the spherical columns (weighted by dV), sorted by r
+        r_index = binning.sorted_index(d, 'r', keys_r, weighted_r, 'dV')
+    rmax = find_rmax(d, index = r_index) 
+    d['j'][d['r'] > rmax] = 0 #Ensures we don't count j for cells above and below the star
+    if use_index:
+        binning.update_index(r_index, d, ['j'])
+        R_index = binning.sorted_index(d, 'R', ['R','dV','dm','j'], ['j'], 'dm')
+    data = d
+#Spherical and cylindrical averages in one pass (find_rmax needs its own, it sets their rmax)
+make_averages(data, [dict(keys = keys_r, weighted_keys = weighted_r, bin_by = 'r', ave = ave, rmax = rmax, index = r_index),
+                  dict(keys = ['R','dV','dm','j'], weighted_keys = ['j'], bin_by = 'R', ave = ave_cyl, resolution = 130, rmax=rmax,\
+                       weight = 'dm', log = True, index = R_index)])
 
 #Compute other parameters using averaged parameters
 ave['rho'] = ave['dm'] / ave['dV']
-ave['mr'] = np.array([sum(ave['dm'][:i+1]) for i in range(len(ave['dm']))])
-ave['q'] = 1-(ave['mr']/sum(ave['dm']))
-ave_cyl['mr'] = np.array([sum(ave_cyl['dm'][:i+1]) for i in range(len(ave_cyl['dm']))])
-ave_cyl['q'] = 1-(ave_cyl['mr']/sum(ave_cyl['dm']))
+ave['mr'] = profiles.enclosed_mass(ave['dm'])
+ave['q'] = profiles.mass_coordinate(ave['dm'])
+ave_cyl['mr'] = profiles.enclosed_mass(ave_cyl['dm'])
+ave_cyl['q'] = profiles.mass_coordinate(ave_cyl['dm'])
 
 #Elements we use in BG nuclear network (mesa_28.net)
 eles = ['neut', 'h1', 'h2', 'he3', 'he4', 'li7', 'be7', 'be9', 'be10', 'b8', 'c12', 'c13',\
@@ -186,7 +240,7 @@ eles = ['neut', 'h1', 'h2', 'he3', 'he4', 'li7', 'be7', 'be9', 'be10', 'b8', 'c1
 NELE = len(eles)
 
 #Use helmholtz EoS to compute thermodynamic variables
-h = helmholtz.helmeos_DE(dens=ave['rho'], ener=ave['eint'], abar=1, zbar=1, tguess = 1e7)
+h = eos_cache.helmeos_DE(dens=ave['rho'], ener=ave['eint'], abar=1, zbar=1, tguess = 1e7, cache = eos_cache_file, table = eos_table)
 
 ave['temp'] = h.temp
 ave['entropy'] = h.stot